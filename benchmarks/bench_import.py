@@ -0,0 +1,52 @@
+"""
+    guard the import time of the package: `import gdalTools` must stay under the budget and must not
+    load any heavy dependency
+
+    python benchmarks/bench_import.py --budget 0.1
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+HEAVY = ('osgeo', 'numpy', 'geopandas', 'rasterio', 'rasterstats', 'shapely')
+
+SNIPPET = """
+import json, sys, time
+start = time.perf_counter()
+import gdalTools
+elapsed = time.perf_counter() - start
+print(json.dumps({'seconds': elapsed, 'loaded': [m for m in %r if m in sys.modules]}))
+""" % (HEAVY,)
+
+
+def measure(repeat):
+    """
+        import the package in fresh interpreters, return the fastest time and the heavy modules loaded
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    best, loaded = None, set()
+    for _ in range(repeat):
+        out = subprocess.check_output([sys.executable, '-c', SNIPPET], env=env)
+        result = json.loads(out.decode().strip().splitlines()[-1])
+        best = result['seconds'] if best is None else min(best, result['seconds'])
+        loaded.update(result['loaded'])
+    return best, sorted(loaded)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--budget', type=float, default=0.1, help='seconds')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    seconds, loaded = measure(args.repeat)
+    print('import gdalTools: %.1f ms, heavy modules loaded: %s' % (seconds * 1000, loaded or 'none'))
+    if seconds > args.budget or loaded:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+    compare the indexed shpTools.intersection with the old all-pairs nested loop
+
+    python benchmarks/bench_intersection.py --na 2000 --nb 500
+"""
+import argparse
+import os
+import tempfile
+import time
+from osgeo import ogr
+
+from gdalTools.shpTools import intersection
+from synthetic import make_squares
+
+
+def nested_loop_intersection(ShpA, ShpB, fname):
+    """
+        the old implementation of shpTools.intersection, kept here as the reference
+    """
+    driver = ogr.GetDriverByName("ESRI Shapefile")
+    dataSourceA = driver.Open(ShpA, 0)
+    layerA = dataSourceA.GetLayer()
+    dataSourceB = driver.Open(ShpB, 0)
+    layerB = dataSourceB.GetLayer()
+    out_ds = driver.CreateDataSource(fname)
+    out_lyr = out_ds.CreateLayer(fname, layerA.GetSpatialRef(), ogr.wkbPolygon)
+    def_feature = out_lyr.GetLayerDefn()
+    for featureA in layerA:
+        geometryA = featureA.GetGeometryRef()
+        for featureB in layerB:
+            geometryB = featureB.GetGeometryRef()
+            inter = geometryB.Intersection(geometryA).Clone()
+            out_feature = ogr.Feature(def_feature)
+            out_feature.SetGeometry(inter)
+            out_lyr.CreateFeature(out_feature)
+    del dataSourceA, dataSourceB, out_ds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--na', type=int, default=2000)
+    parser.add_argument('--nb', type=int, default=500)
+    parser.add_argument('--skip-nested', action='store_true')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='bench_intersection_')
+    shpA = os.path.join(root, 'a.shp')
+    shpB = os.path.join(root, 'b.shp')
+    make_squares(shpA, args.na, 10., 1000., seed=1)
+    make_squares(shpB, args.nb, 40., 1000., seed=2)
+
+    start = time.perf_counter()
+    intersection(shpA, shpB, os.path.join(root, 'indexed.shp'))
+    print('indexed intersection: %.3f s' % (time.perf_counter() - start))
+
+    if not args.skip_nested:
+        start = time.perf_counter()
+        nested_loop_intersection(shpA, shpB, os.path.join(root, 'nested.shp'))
+        print('nested loop intersection: %.3f s' % (time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
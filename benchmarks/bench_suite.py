@@ -0,0 +1,180 @@
+"""
+    time the public operations of gdalTools on synthetic inputs of growing size and write the timings
+    to JSON. With --baseline the run is compared with an earlier JSON and fails on regressions.
+
+    python benchmarks/bench_suite.py --sizes 512 1024 2048 --output results.json
+    python benchmarks/bench_suite.py --baseline results.json --tolerance 0.25
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+from osgeo import gdal
+
+import gdalTools
+from synthetic import make_points, make_raster, make_squares
+
+
+def _tmp(root, name):
+    path = os.path.join(root, name)
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    return path
+
+
+def op_read_write_img(inputs, root):
+    im_proj, im_geotrans, _, _, im_data = gdalTools.read_img(inputs['image'])
+    gdalTools.write_img(_tmp(root, 'write_img.tif'), im_proj, im_geotrans, im_data)
+
+
+def op_image_resampling(inputs, root):
+    gdalTools.image_resampling(inputs['image'], _tmp(root, 'resampled.tif'), scale=0.5)
+
+
+def op_sample_clip(inputs, root):
+    outputdir = _tmp(root, 'clips')
+    os.mkdir(outputdir)
+    gdalTools.sample_clip(inputs['points'], inputs['image'], outputdir, 'poly', 64)
+
+
+def op_intersection(inputs, root):
+    gdalTools.intersection(inputs['squares'], inputs['big_squares'], _tmp(root, 'intersection.shp'))
+
+
+def op_merge_one_shp(inputs, root):
+    gdalTools.MergeOneShp(inputs['squares'], _tmp(root, 'merged.shp'))
+
+
+def op_buffer(inputs, root):
+    gdalTools.buffer(inputs['squares'], _tmp(root, 'buffer.shp'), bdistance=2.)
+
+
+def op_shp2raster(inputs, root):
+    gdalTools.shp2Raster(inputs['squares'], inputs['image'], _tmp(root, 'rasterized.tif'), 0, field='cls')
+
+
+def op_raster2poly(inputs, root):
+    gdalTools.raster2poly(inputs['classes'], _tmp(root, 'polygons.shp'))
+
+
+def op_zonal_statistics(inputs, root):
+    # zonal_statistics 会在原文件中添加字段，复制一份以免影响其他操作的输入
+    shp = _tmp(root, 'zonal.shp')
+    source = os.path.splitext(inputs['big_squares'])[0]
+    for ext in ('.shp', '.shx', '.dbf', '.prj'):
+        if os.path.exists(source + ext):
+            shutil.copyfile(source + ext, os.path.splitext(shp)[0] + ext)
+    gdalTools.zonal_statistics(inputs['classes'], shp, ['majority', 'mean', 'count'])
+
+
+OPERATIONS = {
+    'read_img/write_img': op_read_write_img,
+    'image_resampling': op_image_resampling,
+    'sample_clip': op_sample_clip,
+    'intersection': op_intersection,
+    'MergeOneShp': op_merge_one_shp,
+    'buffer': op_buffer,
+    'shp2Raster': op_shp2raster,
+    'raster2poly': op_raster2poly,
+    'zonal_statistics': op_zonal_statistics,
+}
+
+
+def make_inputs(root, size, seed):
+    """
+        the synthetic inputs of one size: a size x size image, a classified raster and vector layers
+        whose number of features grows with the image
+    """
+    inputs = {
+        'image': os.path.join(root, 'image.tif'),
+        'classes': os.path.join(root, 'classes.tif'),
+        'points': os.path.join(root, 'points.shp'),
+        'squares': os.path.join(root, 'squares.shp'),
+        'big_squares': os.path.join(root, 'big_squares.shp'),
+    }
+    make_raster(inputs['image'], size, bands=3, seed=seed)
+    make_raster(inputs['classes'], size, bands=1, seed=seed + 1, classes=8)
+    make_points(inputs['points'], max(16, size // 16), size, seed + 2, margin=32.)
+    make_squares(inputs['squares'], size * 2, size / 64., size, seed + 3)
+    make_squares(inputs['big_squares'], max(16, size // 8), size / 16., size, seed + 4)
+    return inputs
+
+
+def run(sizes, operations, repeat, seed):
+    """
+        time every operation on every size
+    :return: list of {'operation', 'size', 'seconds', 'min', 'median'}
+    """
+    results = []
+    for size in sizes:
+        root = tempfile.mkdtemp(prefix='gdaltools_bench_%d_' % size)
+        try:
+            inputs = make_inputs(root, size, seed)
+            for name in operations:
+                times = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    OPERATIONS[name](inputs, root)
+                    times.append(time.perf_counter() - start)
+                results.append({'operation': name, 'size': size, 'seconds': times,
+                                'min': min(times), 'median': float(np.median(times))})
+                print('%-20s %6d  %8.3f s' % (name, size, min(times)))
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def environment():
+    import shapely
+
+    return {'python': platform.python_version(), 'platform': platform.platform(),
+            'gdal': gdal.__version__, 'numpy': np.__version__, 'shapely': shapely.__version__,
+            'cpus': os.cpu_count(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def compare(results, baseline, tolerance):
+    """
+        the operations whose minimum time grew by more than tolerance over the baseline
+    """
+    before = {(r['operation'], r['size']): r['min'] for r in baseline['results']}
+    regressions = []
+    for r in results:
+        old = before.get((r['operation'], r['size']))
+        if old is not None and r['min'] > old * (1. + tolerance):
+            regressions.append({'operation': r['operation'], 'size': r['size'], 'baseline': old, 'min': r['min']})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[512, 1024, 2048], help='image sizes in pixels')
+    parser.add_argument('--operations', nargs='+', default=list(OPERATIONS), choices=list(OPERATIONS))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--baseline', help='an earlier output to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown, 0.25 = 25%%')
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.operations, args.repeat, args.seed)
+    report = {'environment': environment(), 'seed': args.seed, 'repeat': args.repeat, 'results': results}
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['regressions'] = compare(results, json.load(f), args.tolerance)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for r in report.get('regressions', []):
+        print('regression: %s at %d: %.3f s -> %.3f s' % (r['operation'], r['size'], r['baseline'], r['min']))
+    if report.get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
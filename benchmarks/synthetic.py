@@ -0,0 +1,92 @@
+"""
+    synthetic inputs for the benchmarks, generated locally from a seed: every layer and raster lives in
+    the square [0, extent] x [0, extent] of EPSG:3857, one raster pixel is one map unit
+"""
+import os
+import numpy as np
+from osgeo import gdal, gdal_array, ogr, osr
+
+
+def _srs():
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(3857)
+    return srs
+
+
+def _create_layer(path, name, geom_type):
+    driver = ogr.GetDriverByName("ESRI Shapefile")
+    if os.path.exists(path):
+        driver.DeleteDataSource(path)
+    ds = driver.CreateDataSource(path)
+    lyr = ds.CreateLayer(name, _srs(), geom_type)
+    lyr.CreateField(ogr.FieldDefn('id', ogr.OFTInteger))
+    lyr.CreateField(ogr.FieldDefn('cls', ogr.OFTInteger))
+    return ds, lyr
+
+
+def make_raster(path, size, bands=3, dtype=np.uint8, seed=0, classes=None, block=32):
+    """
+        write a size x size tiled GeoTIFF. The values are a smooth random field (a coarse noise grid
+        upsampled by block), so compression and polygonization behave like on real images.
+    :param classes: quantize every band into this number of classes, e.g. for raster2poly
+    """
+    rnd = np.random.RandomState(seed)
+    coarse = -(-size // block)
+    datatype = gdal_array.NumericTypeCodeToGDALTypeCode(np.dtype(dtype))
+    ds = gdal.GetDriverByName("GTiff").Create(path, size, size, bands, datatype,
+                                              options=['TILED=YES', 'COMPRESS=DEFLATE'])
+    ds.SetGeoTransform((0., 1., 0., float(size), 0., -1.))
+    ds.SetProjection(_srs().ExportToWkt())
+    for i in range(bands):
+        field = rnd.rand(coarse, coarse)
+        field = np.kron(field, np.ones((block, block)))[:size, :size]
+        field += rnd.rand(size, size) * 0.05
+        if classes:
+            data = np.minimum((field / 1.05 * classes).astype(np.int64), classes - 1)
+        else:
+            data = field / 1.05 * 255
+        ds.GetRasterBand(i + 1).WriteArray(data.astype(dtype))
+    ds = None
+
+
+def make_squares(path, n, size, extent, seed):
+    """
+        write n random squares inside [0, extent] x [0, extent] to a shapefile
+    """
+    rnd = np.random.RandomState(seed)
+    ds, lyr = _create_layer(path, 'squares', ogr.wkbPolygon)
+    defn = lyr.GetLayerDefn()
+    xy = rnd.uniform(0, extent - size, (n, 2))
+    cls = rnd.randint(1, 10, n)
+    lyr.StartTransaction()
+    for i, (x, y) in enumerate(xy.tolist()):
+        wkt = "POLYGON (({0} {1},{2} {1},{2} {3},{0} {3},{0} {1}))".format(x, y, x + size, y + size)
+        feature = ogr.Feature(defn)
+        feature.SetField('id', i)
+        feature.SetField('cls', int(cls[i]))
+        feature.SetGeometry(ogr.CreateGeometryFromWkt(wkt))
+        lyr.CreateFeature(feature)
+    lyr.CommitTransaction()
+    del ds
+
+
+def make_points(path, n, extent, seed, margin=0.):
+    """
+        write n random points inside [margin, extent - margin] to a shapefile
+    """
+    rnd = np.random.RandomState(seed)
+    ds, lyr = _create_layer(path, 'points', ogr.wkbPoint)
+    defn = lyr.GetLayerDefn()
+    xy = rnd.uniform(margin, extent - margin, (n, 2))
+    cls = rnd.randint(1, 10, n)
+    lyr.StartTransaction()
+    for i, (x, y) in enumerate(xy.tolist()):
+        point = ogr.Geometry(ogr.wkbPoint)
+        point.AddPoint_2D(x, y)
+        feature = ogr.Feature(defn)
+        feature.SetField('id', i)
+        feature.SetField('cls', int(cls[i]))
+        feature.SetGeometry(point)
+        lyr.CreateFeature(feature)
+    lyr.CommitTransaction()
+    del ds
@@ -1,4 +1,39 @@
-from .shpTools import *
-from .rasterTools import *
-from .shpConversion import *
-from .rasterConversion import *
+"""
+    the submodules are imported on first attribute access (PEP 562), so `import gdalTools` does not
+    load gdal, numpy or shapely until a function is used
+"""
+import importlib
+
+_submodules = {
+    'shpTools': ('mkdir', 'intersection', 'dissolve', 'MergeOneShp', 'multipoly2singlepoly', 'addPolygon',
+                 'filter_by_area', 'remove_big_feature', 'remove_small_feature', 'buffer', 'smoothing',
+                 'zonal_statistics', 'ZonalStatisticsAsTable', 'geometry_statistics', 'compute_max_area',
+                 'extract_isolated_features', 'simplify_shp'),
+    'rasterTools': ('del_file', 'stretch_n', 'stretch_raster', 'read_img', 'write_img', 'iter_windows',
+                    'crop_core', 'read_windows', 'creation_options', 'TiledWriter', 'resample', 'image_resampling',
+                    'sample_chips', 'sample_clip', 'sliding_windows', 'iter_tiles', 'MosaicStitcher'),
+    'shpConversion': ('line2pol', 'pol2line', 'rasterize', 'shp2Raster'),
+    'rasterConversion': ('raster2poly',),
+    'vectorPipeline': ('VectorPipeline',),
+    'layerWriter': ('LayerWriter',),
+    'instrumentation': ('set_callback', 'instrumented', 'MetricsCollector'),
+    'datasetCache': ('open_raster', 'open_vector', 'raster_info', 'vector_info', 'set_cache_capacity', 'clear_cache',
+                     'invalidate'),
+}
+_exports = {name: module for module, names in _submodules.items() for name in names}
+
+__all__ = sorted(_exports)
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module('.' + name, __name__)
+    if name not in _exports:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    value = getattr(importlib.import_module('.' + _exports[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__) | set(_submodules))
@@ -0,0 +1,206 @@
+"""
+    a process-wide LRU cache of read-only GDAL/OGR datasets and of their metadata. Entries are keyed on
+    the path and the size, mtime and inode of the file (and of the .dbf/.shx of a shapefile), so a
+    rewritten file is opened again. GDAL handles must not be shared between threads, so every thread gets its own
+    handle; the metadata is shared. Evicted handles are closed once nobody else holds them.
+
+        dataset = open_raster('image.tif')     # the same handle on the next call from this thread
+        info = raster_info('image.tif')        # size, geotransform, projection, ... without re-opening
+"""
+import os
+import threading
+from collections import OrderedDict
+
+_LOCK = threading.Lock()
+_HANDLES = OrderedDict()  # (kind, path, stamp, thread) -> dataset
+_METADATA = OrderedDict()  # (kind, path, stamp) -> dict
+_CAPACITY = {'handles': 32, 'metadata': 256}
+_SIDECARS = {'.shp': ('.dbf', '.shx')}
+
+
+def set_cache_capacity(handles=32, metadata=256):
+    """
+        the number of open handles and of metadata entries kept, 0 disables the cache
+    """
+    with _LOCK:
+        _CAPACITY['handles'] = handles
+        _CAPACITY['metadata'] = metadata
+        _evict(_HANDLES, handles)
+        _evict(_METADATA, metadata)
+
+
+def clear_cache():
+    """
+        close every cached handle and forget every metadata entry
+    """
+    with _LOCK:
+        _HANDLES.clear()
+        _METADATA.clear()
+
+
+def invalidate(path):
+    """
+        drop the entries of a path, called before the path is overwritten
+    """
+    path = os.path.abspath(path)
+    with _LOCK:
+        for cache in (_HANDLES, _METADATA):
+            for key in [key for key in cache if key[1] == path]:
+                del cache[key]
+
+
+def _forget_handles():
+    # fork 出的子进程与父进程共享文件描述符和读取位置，子进程必须重新打开
+    global _LOCK
+    _LOCK = threading.Lock()
+    _HANDLES.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_handles)
+
+
+def _evict(cache, capacity):
+    while len(cache) > max(capacity, 0):
+        cache.popitem(last=False)
+
+
+def _stamp(path):
+    """
+        the size, mtime, inode and device of a file and of its sidecar files, None for paths that are
+        not files (/vsimem, URLs, directories), which are never cached. The inode catches a file replaced
+        with one of the same size within the mtime granularity of the filesystem (NFS, FAT).
+    """
+    if not os.path.isfile(path):
+        return None
+    root, ext = os.path.splitext(path)
+    stamp = []
+    for name in (path,) + tuple(root + sidecar for sidecar in _SIDECARS.get(ext.lower(), ())):
+        if os.path.exists(name):
+            st = os.stat(name)
+            stamp.append((st.st_size, st.st_mtime_ns, st.st_ino, st.st_dev))
+    return tuple(stamp)
+
+
+def _cached(cache, key, capacity, create):
+    with _LOCK:
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+    value = create()
+    if value is None or capacity <= 0:
+        return value
+    with _LOCK:
+        cache[key] = value
+        _evict(cache, capacity)
+    return value
+
+
+def _open_raster(path):
+    from osgeo import gdal
+    return gdal.Open(path, 0)
+
+
+def _open_vector(path):
+    from osgeo import ogr
+    return ogr.Open(path, 0)
+
+
+def _reset_layers(datasource):
+    """
+        clear the state a previous user left on the layers of a cached datasource
+    """
+    for i in range(datasource.GetLayerCount()):
+        layer = datasource.GetLayer(i)
+        layer.SetAttributeFilter(None)
+        layer.SetSpatialFilter(None)
+        layer.SetIgnoredFields([])
+        layer.ResetReading()
+    return datasource
+
+
+def open_raster(path):
+    """
+        a read-only gdal dataset of path, cached per thread
+    """
+    stamp = _stamp(path)
+    if stamp is None:
+        return _open_raster(path)
+    key = ('raster', os.path.abspath(path), stamp, threading.get_ident())
+    return _cached(_HANDLES, key, _CAPACITY['handles'], lambda: _open_raster(path))
+
+
+def open_vector(path):
+    """
+        a read-only ogr datasource of path, cached per thread. The layers come back with no filter,
+        no ignored field and the reading reset.
+    """
+    stamp = _stamp(path)
+    if stamp is None:
+        return _open_vector(path)
+    key = ('vector', os.path.abspath(path), stamp, threading.get_ident())
+    datasource = _cached(_HANDLES, key, _CAPACITY['handles'], lambda: _open_vector(path))
+    return _reset_layers(datasource) if datasource is not None else None
+
+
+def _read_raster_info(path):
+    from osgeo import gdal_array as ga
+
+    dataset = open_raster(path)
+    if dataset is None:
+        raise IOError("cannot open raster: %s" % path)
+    bands = [dataset.GetRasterBand(i + 1) for i in range(dataset.RasterCount)]
+    return {
+        'width': dataset.RasterXSize,
+        'height': dataset.RasterYSize,
+        'bands': dataset.RasterCount,
+        'geotransform': dataset.GetGeoTransform(),
+        'projection': dataset.GetProjection(),
+        'datatypes': tuple(band.DataType for band in bands),
+        'dtypes': tuple(ga.GDALTypeCodeToNumericTypeCode(band.DataType) for band in bands),
+        'nodata': tuple(band.GetNoDataValue() for band in bands),
+        'block_size': tuple(bands[0].GetBlockSize()) if bands else None,
+    }
+
+
+def _read_vector_info(path):
+    datasource = open_vector(path)
+    if datasource is None:
+        raise IOError("cannot open vector: %s" % path)
+    layer = datasource.GetLayer()
+    srs = layer.GetSpatialRef()
+    defn = layer.GetLayerDefn()
+    return {
+        'layer': layer.GetName(),
+        'feature_count': layer.GetFeatureCount(),
+        'geom_type': layer.GetGeomType(),
+        'srs': srs.ExportToWkt() if srs is not None else None,
+        'extent': layer.GetExtent(),
+        'fields': tuple((defn.GetFieldDefn(i).GetNameRef(), defn.GetFieldDefn(i).GetType())
+                        for i in range(defn.GetFieldCount())),
+    }
+
+
+def raster_info(path):
+    """
+        the metadata of a raster, shared by every thread and not to be modified
+    :return: dict of width, height, bands, geotransform, projection, datatypes (GDAL), dtypes (numpy),
+            nodata, block_size
+    """
+    stamp = _stamp(path)
+    if stamp is None:
+        return _read_raster_info(path)
+    key = ('raster', os.path.abspath(path), stamp)
+    return _cached(_METADATA, key, _CAPACITY['metadata'], lambda: _read_raster_info(path))
+
+
+def vector_info(path):
+    """
+        the metadata of the first layer of a vector file, shared by every thread and not to be modified
+    :return: dict of layer, feature_count, geom_type, srs (WKT), extent, fields [(name, type)]
+    """
+    stamp = _stamp(path)
+    if stamp is None:
+        return _read_vector_info(path)
+    key = ('vector', os.path.abspath(path), stamp)
+    return _cached(_METADATA, key, _CAPACITY['metadata'], lambda: _read_vector_info(path))
@@ -0,0 +1,149 @@
+"""
+    progress and metrics hooks of the package. Nothing is reported until a callback is installed; until
+    then timer() returns a shared no-op object and progress() returns at once, so the hooks cost one
+    attribute lookup in the loops they sit in.
+
+        collector = MetricsCollector()
+        with instrumented(collector):
+            resample('in.tif', 'out.tif', 0.5)
+        collector.summary()
+
+    The callback receives dicts:
+        {'event': 'stage', 'operation', 'stage', 'seconds', 'items', 'bytes'[, 'cache_used', 'cache_max']}
+        {'event': 'progress', 'operation', 'done', 'total'}
+    stage is one of 'open', 'read', 'compute', 'write'.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+_STATE = {'callback': None, 'gdal_cache': False}
+
+
+def set_callback(callback, gdal_cache=False):
+    """
+        install the callback receiving the events of every operation, None to disable
+    :param callback: callable taking one dict, called from worker threads too
+    :param gdal_cache: add the GDAL block cache usage to the stage events
+    :return: the previous (callback, gdal_cache)
+    """
+    previous = (_STATE['callback'], _STATE['gdal_cache'])
+    _STATE['callback'] = callback
+    _STATE['gdal_cache'] = gdal_cache
+    return previous
+
+
+@contextmanager
+def instrumented(callback, gdal_cache=False):
+    """
+        install a callback for the duration of a with block
+    """
+    previous = set_callback(callback, gdal_cache)
+    try:
+        yield callback
+    finally:
+        set_callback(*previous)
+
+
+def enabled():
+    return _STATE['callback'] is not None
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def add(self, items=0, nbytes=0):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer(object):
+    def __init__(self, callback, operation, stage, items, nbytes):
+        self.callback = callback
+        self.operation = operation
+        self.stage = stage
+        self.items = items
+        self.nbytes = nbytes
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        event = {'event': 'stage', 'operation': self.operation, 'stage': self.stage,
+                 'seconds': time.perf_counter() - self.start, 'items': self.items, 'bytes': self.nbytes}
+        if _STATE['gdal_cache']:
+            from osgeo import gdal
+            event['cache_used'] = gdal.GetCacheUsed()
+            event['cache_max'] = gdal.GetCacheMax()
+        self.callback(event)
+        return False
+
+    def add(self, items=0, nbytes=0):
+        """
+            count the features (or pixels, tiles) and bytes processed inside the stage
+        """
+        self.items += items
+        self.nbytes += nbytes
+
+
+def timer(operation, stage, items=0, nbytes=0):
+    """
+        time one stage of an operation: with timer('resample', 'read') as t: ...; t.add(nbytes=data.nbytes)
+    """
+    callback = _STATE['callback']
+    if callback is None:
+        return _NULL_TIMER
+    return _Timer(callback, operation, stage, items, nbytes)
+
+
+def progress(operation, done, total=None):
+    """
+        report that done of total units of an operation are finished
+    """
+    callback = _STATE['callback']
+    if callback is not None:
+        callback({'event': 'progress', 'operation': operation, 'done': done, 'total': total})
+
+
+class MetricsCollector(object):
+    """
+        a callback accumulating the time, items and bytes of every (operation, stage)
+    :param on_progress: optional callable(operation, done, total) for progress events, e.g. a progress bar
+    """
+    def __init__(self, on_progress=None):
+        self.on_progress = on_progress
+        self.stages = {}
+        self.cache_peak = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        if event['event'] == 'progress':
+            if self.on_progress is not None:
+                self.on_progress(event['operation'], event['done'], event['total'])
+            return
+        with self._lock:
+            totals = self.stages.setdefault((event['operation'], event['stage']), [0, 0., 0, 0])
+            totals[0] += 1
+            totals[1] += event['seconds']
+            totals[2] += event['items']
+            totals[3] += event['bytes']
+            self.cache_peak = max(self.cache_peak, event.get('cache_used', 0))
+
+    def summary(self):
+        """
+        :return: dict of (operation, stage) -> {'calls', 'seconds', 'items', 'bytes', 'items_per_s', 'mb_per_s'}
+        """
+        result = {}
+        with self._lock:
+            for key, (calls, seconds, items, nbytes) in self.stages.items():
+                result[key] = {'calls': calls, 'seconds': seconds, 'items': items, 'bytes': nbytes,
+                               'items_per_s': items / seconds if seconds > 0 else None,
+                               'mb_per_s': nbytes / seconds / 1e6 if seconds > 0 else None}
+        return result
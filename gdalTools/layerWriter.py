@@ -0,0 +1,177 @@
+"""
+    the output layer shared by the vector writers: the format is chosen from the file extension
+    (or given explicitly) and features are committed in transactions of batch_size features
+"""
+import os
+from osgeo import ogr
+from .datasetCache import invalidate
+
+_DRIVERS = {
+    '.shp': 'ESRI Shapefile',
+    '.gpkg': 'GPKG',
+    '.fgb': 'FlatGeobuf',
+    '.parquet': 'Parquet',
+    '.geojson': 'GeoJSON',
+    '.geojsonl': 'GeoJSONSeq',
+}
+
+# 单部件类型对应的多部件类型
+_MULTI = {ogr.wkbPoint: ogr.wkbMultiPoint, ogr.wkbLineString: ogr.wkbMultiLineString,
+          ogr.wkbPolygon: ogr.wkbMultiPolygon}
+
+
+def driver_name(path, driver=None):
+    """
+        the OGR driver of an output path, ESRI Shapefile if the extension is not known
+    """
+    if driver is not None:
+        return driver
+    return _DRIVERS.get(os.path.splitext(path)[1].lower(), 'ESRI Shapefile')
+
+
+def create_datasource(path, driver=None):
+    """
+        create an output datasource, deleting the existing one
+    :param path: the path of output
+    :param driver: the name of OGR driver, chosen from the extension if None
+    """
+    name = driver_name(path, driver)
+    drv = ogr.GetDriverByName(name)
+    if drv is None:
+        raise ValueError("GDAL has no %s driver" % name)
+    invalidate(path)
+    if os.path.exists(path):
+        drv.DeleteDataSource(path)
+    return drv.CreateDataSource(path)
+
+
+def _copy_field_defns(src_defn, out_lyr, taken):
+    """
+        create the fields of src_defn in out_lyr, renaming the ones already taken
+    :return: the field map for Feature.SetFromWithMap
+    """
+    field_map = []
+    for i in range(src_defn.GetFieldCount()):
+        field = src_defn.GetFieldDefn(i)
+        name = new_name = field.GetNameRef()
+        k = 1
+        while new_name.lower() in taken:
+            suffix = '_%d' % k
+            new_name = name[:10 - len(suffix)] + suffix  # shapefile 字段名最长10个字符
+            k += 1
+        taken.add(new_name.lower())
+        out_field = ogr.FieldDefn(new_name, field.GetType())
+        out_field.SetWidth(field.GetWidth())
+        out_field.SetPrecision(field.GetPrecision())
+        field_map.append(out_lyr.GetLayerDefn().GetFieldCount())
+        out_lyr.CreateField(out_field)
+    return field_map
+
+
+class LayerWriter(object):
+    """
+        write features into a new layer, batch_size features per transaction
+    :param path: the path of output, .shp, .gpkg, .fgb, .parquet or .geojson
+    :param srs: the spatial reference of output
+    :param geom_type: the geometry type of output
+    :param driver: the name of OGR driver, chosen from the extension if None
+    :param layer_name: the name of layer, the file name if None
+    :param batch_size: the number of features in one transaction
+    :param options: layer creation options
+    """
+    def __init__(self, path, srs, geom_type, driver=None, layer_name=None, batch_size=10000, options=None):
+        self.ds = create_datasource(path, driver)
+        name = layer_name or os.path.splitext(os.path.basename(path))[0]
+        self.layer = self.ds.CreateLayer(name, srs, geom_type, options or [])
+        self._geom_type = ogr.GT_Flatten(geom_type)
+        self.batch_size = batch_size
+        self.count = 0
+        self._pending = 0
+        self._taken = set()
+        # GPKG 等支持数据集级事务，shapefile 的图层事务为空操作
+        self._transactions = self.ds.TestCapability(ogr.ODsCTransactions)
+
+    @property
+    def defn(self):
+        return self.layer.GetLayerDefn()
+
+    def copy_fields(self, src_defn):
+        """
+            create the fields of a source layer definition
+        :return: the field map to pass to write()
+        """
+        return _copy_field_defns(src_defn, self.layer, self._taken)
+
+    def add_field(self, field_defn):
+        self._taken.add(field_defn.GetNameRef().lower())
+        self.layer.CreateField(field_defn)
+
+    def _conform(self, geometry):
+        """
+            match the geometry to the layer type, FlatGeobuf and GPKG reject mismatching features:
+            single parts are promoted into a multi layer, one-part multis are unwrapped into a single layer
+        """
+        if geometry is None or self._geom_type in (ogr.wkbUnknown, ogr.wkbGeometryCollection):
+            return geometry
+        geom_type = ogr.GT_Flatten(geometry.GetGeometryType())
+        if geom_type == self._geom_type:
+            return geometry
+        if _MULTI.get(geom_type) == self._geom_type:
+            return ogr.ForceTo(geometry, self._geom_type)
+        if _MULTI.get(self._geom_type) == geom_type and geometry.GetGeometryCount() == 1:
+            return geometry.GetGeometryRef(0).Clone()
+        return geometry
+
+    def _begin(self):
+        if self._transactions:
+            self.ds.StartTransaction()
+        else:
+            self.layer.StartTransaction()
+
+    def _commit(self):
+        if self._transactions:
+            self.ds.CommitTransaction()
+        else:
+            self.layer.CommitTransaction()
+
+    def write(self, geometry, sources=(), values=None):
+        """
+            write one feature
+        :param geometry: ogr geometry, WKB or None
+        :param sources: (feature, field_map) pairs whose attributes are copied
+        :param values: dict of field name -> value
+        """
+        if self._pending == 0:
+            self._begin()
+        feature = ogr.Feature(self.defn)
+        for source, field_map in sources:
+            feature.SetFromWithMap(source, 1, field_map)
+        if values:
+            for key, value in values.items():
+                if value is not None:
+                    feature.SetField(key, value)
+        if isinstance(geometry, (bytes, bytearray)):
+            geometry = ogr.CreateGeometryFromWkb(geometry)
+        feature.SetGeometry(self._conform(geometry))
+        if self.layer.CreateFeature(feature) != ogr.OGRERR_NONE:
+            raise RuntimeError("cannot write feature %d into layer %s" % (self.count, self.layer.GetName()))
+        self.count += 1
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            self._commit()
+            self._pending = 0
+
+    def close(self):
+        if self.ds is None:
+            return
+        if self._pending:
+            self._commit()
+            self._pending = 0
+        self.ds = None
+        self.layer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -1,21 +1,190 @@
 from osgeo import gdalconst, gdal, ogr, osr
 import os
+import shutil
+import tempfile
+from .datasetCache import invalidate, open_raster
+from .instrumentation import progress, timer
+from .layerWriter import LayerWriter, create_datasource
 
 
-def raster2poly(raster, outshp):
-    inraster = gdal.Open(raster)  # 读取路径中的栅格数据
-    inband = inraster.GetRasterBand(1)  # 这个波段就是最后想要转为矢量的波段，如果是单波段数据的话那就都是1
+def _polygonize_options(connectedness):
+    return ['8CONNECTED=8'] if connectedness == 8 else []
+
+
+def _mask_band(dataset, band, mask):
+    """
+        the mask band used by Polygonize/SieveFilter: None, the band's own mask ('auto') or band 1 of a
+        mask raster given as a dataset
+    """
+    if mask is None:
+        return None
+    if mask == 'auto':
+        return band.GetMaskBand()
+    return mask.GetRasterBand(1)
+
+
+def _sieve_to_file(dataset, band_index, mask, path, min_area, connectedness):
+    """
+        sieve one band of a raster into a tiled GeoTIFF, keeping its nodata value so that mask='auto'
+        still applies to the result. SieveFilter goes over the scanlines and only keeps the polygon
+        bookkeeping in memory, not the band.
+    """
+    band = dataset.GetRasterBand(band_index)
+    out = gdal.GetDriverByName('GTiff').Create(path, dataset.RasterXSize, dataset.RasterYSize, 1, band.DataType,
+                                               options=['TILED=YES', 'BIGTIFF=IF_SAFER'])
+    out.SetGeoTransform(dataset.GetGeoTransform())
+    out.SetProjection(dataset.GetProjection())
+    out_band = out.GetRasterBand(1)
+    if band.GetNoDataValue() is not None:
+        out_band.SetNoDataValue(band.GetNoDataValue())
+    mask_ds = open_raster(mask) if mask not in (None, 'auto') else None
+    gdal.SieveFilter(band, _mask_band(dataset, band, mask if mask_ds is None else mask_ds), out_band,
+                     min_area, connectedness)
+    out.FlushCache()
+    out = None
+
+
+def _polygonize_tile(args):
+    """
+        polygonize one tile into a memory layer
+    :return: list of (value, wkb)
+    """
+    raster, band_index, mask, window, connectedness = args
+    dataset = open_raster(raster)
+    tile = gdal.Translate('', dataset, format='MEM', srcWin=list(window), bandList=[band_index])
+    tile_mask = None
+    if mask is not None and mask != 'auto':
+        tile_mask = gdal.Translate('', mask, format='MEM', srcWin=list(window), bandList=[1])
+    tile_band = tile.GetRasterBand(1)
+
+    mem_ds = ogr.GetDriverByName('Memory').CreateDataSource('')
+    mem_lyr = mem_ds.CreateLayer('poly', None, ogr.wkbPolygon)
+    mem_lyr.CreateField(ogr.FieldDefn('value', ogr.OFTReal))
+    gdal.FPolygonize(tile_band, _mask_band(tile, tile_band, mask if tile_mask is None else tile_mask),
+                     mem_lyr, 0, _polygonize_options(connectedness))
+    return [(feature.GetField(0), feature.GetGeometryRef().ExportToWkb()) for feature in mem_lyr]
+
+
+def _on_seam(envelope, seams_x, seams_y, tolerance):
+    """
+        whether an envelope touches one of the internal tile edges
+    """
+    for x in seams_x:
+        if abs(envelope[0] - x) < tolerance or abs(envelope[1] - x) < tolerance:
+            return True
+    for y in seams_y:
+        if abs(envelope[2] - y) < tolerance or abs(envelope[3] - y) < tolerance:
+            return True
+    return False
+
+
+def raster2poly(raster, outshp, tile_size=None, workers=None, mask=None, connectedness=4, min_area=0, band=1):
+    """
+        polygonize a raster band. With tile_size, every tile is polygonized on its own (in worker processes
+        if workers > 1) and the polygons crossing tile seams are stitched back together by dissolving
+        them on value.
+    :param raster: the path of raster
+    :param outshp: the path of output, the format follows the extension (.shp, .gpkg, .fgb)
+    :param tile_size: the size of tiles in pixels, the whole band is polygonized at once if None
+    :param workers: the number of worker processes for tiles
+    :param mask: None, 'auto' for the nodata/mask band of the raster, or the path of a mask raster
+    :param connectedness: 4 or 8. With tile_size and 8, regions of one value that only touch diagonally
+            across a tile seam come out as separate polygons, where the untiled mode gives one
+    :param min_area: polygons smaller than this number of pixels are sieved into their neighbours first.
+            With tile_size, the whole band is sieved once into a temporary GeoTIFF next to the output,
+            whose tiles are then polygonized
+    :param band: the index of band
+    :return:
+    """
+    inraster = open_raster(raster)  # 读取路径中的栅格数据
     prj = osr.SpatialReference()
     prj.ImportFromWkt(inraster.GetProjection())  # 读取栅格数据的投影信息，用来为后面生成的矢量做准备
+    layer_name = os.path.splitext(os.path.basename(raster))[0]
+
+    if tile_size is None:
+        inband = inraster.GetRasterBand(band)  # 这个波段就是最后想要转为矢量的波段
+        mask_ds = open_raster(mask) if mask not in (None, 'auto') else None
+        if min_area > 0:
+            sieved = gdal.GetDriverByName('MEM').CreateCopy('', inraster)
+            inband = sieved.GetRasterBand(band)
+            gdal.SieveFilter(inband, _mask_band(sieved, inband, mask if mask_ds is None else mask_ds), inband,
+                             min_area, connectedness)
+        Polygon = create_datasource(outshp)  # 创建一个目标文件，格式由扩展名决定，已存在则删除
+        Poly_layer = Polygon.CreateLayer(layer_name, srs=prj, geom_type=ogr.wkbPolygon)  # 对shp文件创建一个图层，定义为面类，与FPolygonize输出一致
+        newField = ogr.FieldDefn('value', ogr.OFTReal)  # 给目标shp文件添加一个字段，用来存储原始栅格的pixel value
+        Poly_layer.CreateField(newField)
+
+        gdal.FPolygonize(inband, _mask_band(inraster, inband, mask if mask_ds is None else mask_ds), Poly_layer, 0,
+                         _polygonize_options(connectedness))  # 核心函数，执行的就是栅格转矢量操作
+        Polygon.SyncToDisk()
+        Polygon = None
+        return
+
+    width, height = inraster.RasterXSize, inraster.RasterYSize
+    gt = inraster.GetGeoTransform()
+    source, source_band, scratch = raster, band, None
+    if min_area > 0:
+        # 整个波段只筛选一次，瓦片之间的筛选结果一致，瓦片读取不再需要 halo
+        scratch = tempfile.mkdtemp(prefix='raster2poly_', dir=os.path.dirname(os.path.abspath(outshp)))
+        source, source_band = os.path.join(scratch, 'sieved.tif'), 1
+        with timer('raster2poly', 'compute', width * height):
+            _sieve_to_file(inraster, band, mask, source, min_area, connectedness)
+    del inraster
+    try:
+        _polygonize_tiles(source, source_band, mask, outshp, prj, layer_name, width, height, gt, tile_size,
+                          workers, connectedness)
+    finally:
+        if scratch is not None:
+            invalidate(source)  # 关闭缓存中临时栅格的句柄
+            shutil.rmtree(scratch, ignore_errors=True)
+
+
+def _polygonize_tiles(raster, band, mask, outshp, prj, layer_name, width, height, gt, tile_size, workers,
+                      connectedness):
+    """
+        polygonize the tiles of a band and dissolve the polygons crossing the tile seams on value
+    """
+    import shapely
+
+    windows = [(x, y, min(tile_size, width - x), min(tile_size, height - y))
+               for y in range(0, height, tile_size) for x in range(0, width, tile_size)]
+    tasks = [(raster, band, mask, window, connectedness) for window in windows]
+    seams_x = [gt[0] + x * gt[1] for x in range(tile_size, width, tile_size)]
+    seams_y = [gt[3] + y * gt[5] for y in range(tile_size, height, tile_size)]
+    tolerance = min(abs(gt[1]), abs(gt[5])) / 2.
+
+    writer = LayerWriter(outshp, prj, ogr.wkbPolygon, layer_name=layer_name)
+    writer.add_field(ogr.FieldDefn('value', ogr.OFTReal))
+    seam_polygons = {}
+    if workers is not None and workers > 1:
+        from multiprocessing import Pool
+        pool = Pool(workers)
+        results = pool.imap(_polygonize_tile, tasks)
+    else:
+        pool = None
+        results = map(_polygonize_tile, tasks)
+    try:
+        for k, window in enumerate(windows):
+            with timer('raster2poly', 'compute', window[2] * window[3]):
+                polygons = next(results)
+            with timer('raster2poly', 'write', len(polygons)):
+                for value, wkb in polygons:
+                    geometry = ogr.CreateGeometryFromWkb(wkb)
+                    if _on_seam(geometry.GetEnvelope(), seams_x, seams_y, tolerance):
+                        seam_polygons.setdefault(value, []).append(wkb)
+                    else:
+                        writer.write(geometry, values={'value': value})
+            progress('raster2poly', k + 1, len(windows))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
 
-    drv = ogr.GetDriverByName("ESRI Shapefile")
-    if os.path.exists(outshp):  # 若文件已经存在，则删除它继续重新做一遍
-        drv.DeleteDataSource(outshp)
-    Polygon = drv.CreateDataSource(outshp)  # 创建一个目标文件
-    Poly_layer = Polygon.CreateLayer(raster[:-4], srs=prj, geom_type=ogr.wkbMultiPolygon)  # 对shp文件创建一个图层，定义为多个面类
-    newField = ogr.FieldDefn('value', ogr.OFTReal)  # 给目标shp文件添加一个字段，用来存储原始栅格的pixel value
-    Poly_layer.CreateField(newField)
-
-    gdal.FPolygonize(inband, None, Poly_layer, 0)  # 核心函数，执行的就是栅格转矢量操作
-    Polygon.SyncToDisk()
-    Polygon = None
\ No newline at end of file
+    # 跨瓦片边界的面按值融合后再拆成单部件
+    with timer('raster2poly', 'compute', sum(len(wkbs) for wkbs in seam_polygons.values())):
+        for value, wkbs in seam_polygons.items():
+            merged = shapely.union_all(shapely.from_wkb(wkbs))
+            for part in shapely.get_parts(merged):
+                writer.write(shapely.to_wkb(part), values={'value': value})
+    with timer('raster2poly', 'write'):
+        writer.close()
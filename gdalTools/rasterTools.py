@@ -1,7 +1,10 @@
-import os, sys, time
+import os
 import numpy as np
-from osgeo import ogr, gdal, gdalconst
+from osgeo import ogr, gdal
 from osgeo import gdal_array as ga
+from .datasetCache import invalidate, open_raster, open_vector, raster_info
+from .instrumentation import progress, timer
+from .layerWriter import LayerWriter
 
 def del_file(path):
     for i in os.listdir(path):
@@ -19,20 +22,149 @@ def stretch_n(bands, img_min, img_max, lower_percent=0, higher_percent=100):
     :param img_max:    目标位深的最大值
     :return:
     """
-    out = np.zeros_like(bands).astype(np.float32)
     a = img_min
     b = img_max
-    c = np.percentile(bands[:, :], lower_percent)
-    d = np.percentile(bands[:, :], higher_percent)
-    t = a + (bands[:, :] - c) * (b - a) / (d - c)
-    t[t < a] = a
-    t[t > b] = b
-    out[:, :] = t
+    c, d = np.percentile(bands, [lower_percent, higher_percent])  # 一次排序得到两个分位数
+    out = bands.astype(np.float32)
+    out -= c
+    out *= (b - a) / (d - c)
+    out += a
+    np.clip(out, a, b, out=out)
     return out
 
 
+def _band_histogram(dataset, band_indexes, nodata, bins):
+    """
+        stream the bands and build one histogram over them
+    :return: (counts, edges). Integer bands of at most 16 bits get one exact bin per value,
+            other bands get `bins` bins between their minimum and maximum, one bin if the bands are
+            constant and no bin if they have no valid pixel
+    """
+    band = dataset.GetRasterBand(band_indexes[0])
+    dtype = np.dtype(ga.GDALTypeCodeToNumericTypeCode(band.DataType))
+    exact = dtype.kind in 'ui' and dtype.itemsize <= 2
+    if exact:
+        lo, hi = int(np.iinfo(dtype).min), int(np.iinfo(dtype).max)
+    else:
+        ranges = []
+        for i in band_indexes:
+            try:
+                r = dataset.GetRasterBand(i).ComputeRasterMinMax(False)
+            except RuntimeError:
+                r = None
+            # 整个波段都是 nodata 时没有最值（未开启异常时返回 None 或 NaN）
+            if r is not None and np.isfinite(r).all():
+                ranges.append(r)
+        if not ranges:
+            return np.zeros(0, dtype=np.int64), np.zeros(1)
+        lo, hi = min(r[0] for r in ranges), max(r[1] for r in ranges)
+    if exact:
+        nbins = hi - lo + 1
+        edges = np.arange(lo, hi + 2)
+    elif hi > lo:
+        nbins = bins
+        edges = np.linspace(lo, hi, nbins + 1)
+    else:
+        # 常数波段的边界不递增，np.histogram 会报错，只用一个包含该值的区间
+        nbins = 1
+        edges = np.array([lo, lo + 1.])
+    counts = np.zeros(nbins, dtype=np.int64)
+    for read_window, _ in iter_windows(dataset):
+        for index in band_indexes:
+            data = dataset.GetRasterBand(index).ReadAsArray(*read_window).ravel()
+            if nodata is not None:
+                data = data[data != nodata]
+            if exact:
+                counts += np.bincount((data.astype(np.int64) - lo), minlength=nbins)
+            else:
+                counts += np.histogram(data, bins=edges)[0]
+    return counts, edges
+
+
+def _histogram_percentiles(counts, edges, percents):
+    """
+        the percentiles of a histogram, exact for one-value-per-bin histograms
+    :return: list of values, None for each percent if the histogram is empty
+    """
+    cumulative = np.cumsum(counts)
+    total = cumulative[-1] if len(cumulative) else 0
+    if total == 0:
+        return [None for _ in percents]
+    values = []
+    for p in percents:
+        rank = p / 100. * (total - 1)
+        k = int(np.searchsorted(cumulative, rank, side='right'))
+        values.append(float(edges[min(k, len(counts) - 1)]))
+    return values
+
+
+def stretch_raster(source_file, target_file, img_min=0, img_max=255, lower_percent=0, higher_percent=100,
+                   per_band=True, nodata=None, out_nodata=None, dtype=np.uint8, bins=65536, profile='deflate'):
+    """
+        percentile stretch of an image of any size. The percentiles come from a histogram built over
+        windowed reads, the linear stretch is then applied window by window into the output,
+        so only one window is held in memory.
+    :param source_file: the path of source file
+    :param target_file: the path of target file
+    :param img_min: 目标位深的最小值
+    :param img_max: 目标位深的最大值
+    :param lower_percent: the lower percentile
+    :param higher_percent: the higher percentile
+    :param per_band: stretch every band with its own percentiles, or all bands with common ones
+    :param nodata: the nodata value of source, the band nodata if None
+    :param out_nodata: the value written for nodata pixels, img_min if None
+    :param dtype: the data type of output
+    :param bins: the number of histogram bins for float and 32-bit bands
+    :param profile: the output profile, see creation_options
+    :return: the (lower, higher) values used for every band, (None, None) for a band without valid pixels
+    """
+    dataset = open_raster(source_file)
+    band_count = dataset.RasterCount
+    if nodata is None:
+        nodata = dataset.GetRasterBand(1).GetNoDataValue()
+    if out_nodata is None:
+        out_nodata = img_min
+
+    if per_band:
+        limits = [_histogram_percentiles(*_band_histogram(dataset, [i + 1], nodata, bins),
+                                         percents=(lower_percent, higher_percent)) for i in range(band_count)]
+    else:
+        limits = [_histogram_percentiles(*_band_histogram(dataset, list(range(1, band_count + 1)), nodata, bins),
+                                         percents=(lower_percent, higher_percent))] * band_count
+
+    a, b = img_min, img_max
+    with TiledWriter(target_file, dataset.RasterXSize, dataset.RasterYSize, band_count, dtype,
+                     dataset.GetProjection(), dataset.GetGeoTransform(),
+                     nodata=out_nodata if nodata is not None else None, profile=profile) as writer:
+        for read_window, _ in iter_windows(dataset):
+            for index, (c, d) in enumerate(limits):
+                with timer('stretch_raster', 'read') as t:
+                    data = dataset.GetRasterBand(index + 1).ReadAsArray(*read_window)
+                    t.add(data.size, data.nbytes)
+                with timer('stretch_raster', 'compute', data.size, data.nbytes):
+                    mask = data == nodata if nodata is not None else None
+                    if c is None or d <= c:
+                        # 没有有效像素或波段为常数时输出为 img_min
+                        out = np.full(data.shape, a, dtype=np.float32)
+                    else:
+                        out = data.astype(np.float32)
+                        out -= c
+                        out *= (b - a) / (d - c)
+                        out += a
+                        np.clip(out, a, b, out=out)
+                    del data
+                    if mask is not None:
+                        out[mask] = out_nodata
+                    out = out.astype(dtype)
+                with timer('stretch_raster', 'write', out.size, out.nbytes):
+                    writer.dataset.GetRasterBand(index + 1).WriteArray(out, read_window[0], read_window[1])
+            progress('stretch_raster', read_window[1] + read_window[3], dataset.RasterYSize)
+    del dataset
+    return [tuple(limit) for limit in limits]
+
+
 def read_img(filename):
-    dataset=gdal.Open(filename)
+    dataset = open_raster(filename)
 
     im_width = dataset.RasterXSize
     im_height = dataset.RasterYSize
@@ -45,7 +177,11 @@ def read_img(filename):
     return im_proj, im_geotrans, im_width, im_height, im_data
 
 
-def write_img(filename, im_proj, im_geotrans, im_data):
+def write_img(filename, im_proj, im_geotrans, im_data, profile='deflate'):
+    """
+        write an array into a GeoTIFF
+    :param profile: the output profile, see creation_options; 'gtiff' keeps the striped, uncompressed layout
+    """
     if 'int8' in im_data.dtype.name:
         datatype = gdal.GDT_Byte
     elif 'int16' in im_data.dtype.name:
@@ -58,72 +194,486 @@ def write_img(filename, im_proj, im_geotrans, im_data):
     else:
         im_bands, (im_height, im_width) = 1,im_data.shape
 
-    driver = gdal.GetDriverByName("GTiff")
-    dataset = driver.Create(filename, im_width, im_height, im_bands, datatype)
+    with TiledWriter(filename, im_width, im_height, im_bands, datatype, im_proj, im_geotrans,
+                     profile=profile) as writer:
+        writer.write(0, 0, im_data)
+
+
+def _gdal_datatype(dtype):
+    """
+        the GDAL data type of a numpy dtype, or the GDAL data type itself
+    """
+    if isinstance(dtype, int):
+        return dtype
+    return ga.NumericTypeCodeToGDALTypeCode(np.dtype(dtype))
 
-    dataset.SetGeoTransform(im_geotrans)
-    dataset.SetProjection(im_proj)
 
-    if im_bands == 1:
-        dataset.GetRasterBand(1).WriteArray(im_data)
+def iter_windows(dataset, overlap=0, block_size=None, min_size=256):
+    """
+        generate windows covering the dataset, aligned to its native block size
+    :param dataset: the gdal dataset
+    :param overlap: the number of halo pixels added around each window
+    :param block_size: (xsize, ysize) of the windows, the native block size if None
+    :param min_size: native blocks smaller than this (e.g. strips) are grouped together
+    :return: yields (read_window, core_window), both (xoff, yoff, xsize, ysize).
+            core_window tiles the dataset without overlap, read_window is the core window
+            grown by overlap and clipped to the dataset
+    """
+    width, height = dataset.RasterXSize, dataset.RasterYSize
+    if block_size is None:
+        bx, by = dataset.GetRasterBand(1).GetBlockSize()
+        bx = bx * max(1, -(-min(min_size, width) // bx))
+        by = by * max(1, -(-min(min_size, height) // by))
     else:
-        for i in range(im_bands):
-            dataset.GetRasterBand(i+1).WriteArray(im_data[i])
+        bx, by = block_size
+    for yoff in range(0, height, by):
+        ysize = min(by, height - yoff)
+        for xoff in range(0, width, bx):
+            xsize = min(bx, width - xoff)
+            x0, y0 = max(0, xoff - overlap), max(0, yoff - overlap)
+            x1, y1 = min(width, xoff + xsize + overlap), min(height, yoff + ysize + overlap)
+            yield (x0, y0, x1 - x0, y1 - y0), (xoff, yoff, xsize, ysize)
+
 
+def crop_core(data, read_window, core_window):
+    """
+        remove the halo of an array read with iter_windows
+    """
+    x = core_window[0] - read_window[0]
+    y = core_window[1] - read_window[1]
+    return data[..., y:y + core_window[3], x:x + core_window[2]]
+
+
+def read_windows(filename, overlap=0, block_size=None):
+    """
+        stream a raster window by window, only one window is held in memory
+    :param filename: the path of image
+    :param overlap: the number of halo pixels added around each window
+    :param block_size: (xsize, ysize) of the windows, the native block size if None
+    :return: yields (read_window, core_window, data), data is (bands, rows, cols) or (rows, cols)
+    """
+    dataset = open_raster(filename)
+    for read_window, core_window in iter_windows(dataset, overlap, block_size):
+        yield read_window, core_window, dataset.ReadAsArray(*read_window)
     del dataset
 
 
-def image_resampling(source_file, target_file, scale=5.):
+# 输出配置对应的压缩方式，'gtiff' 为条带、不压缩的旧版布局
+_PROFILES = {'gtiff': None, 'tiled': 'NONE', 'deflate': 'DEFLATE', 'zstd': 'ZSTD', 'lzw': 'LZW', 'cog': 'DEFLATE'}
+
+
+def _predictor(datatype):
+    return 3 if datatype in (gdal.GDT_Float32, gdal.GDT_Float64) else 2
+
+
+def creation_options(profile='deflate', datatype=gdal.GDT_Byte, block_size=256):
     """
-          image resampling
+        the GTiff creation options of an output profile
+    :param profile: 'gtiff' (striped, uncompressed), 'tiled', 'deflate', 'zstd', 'lzw' (tiled, compressed with
+            a predictor) or 'cog' (written tiled, converted to a Cloud-Optimized GeoTIFF with overviews on close)
+    :param datatype: numpy dtype or GDAL data type, chooses the predictor
+    :param block_size: the tile size, a multiple of 16
+    :return: list of creation options
+    """
+    if profile not in _PROFILES:
+        raise ValueError("unknown output profile: %s" % profile)
+    if profile == 'gtiff':
+        return []
+    options = ['TILED=YES', 'BLOCKXSIZE=%d' % block_size, 'BLOCKYSIZE=%d' % block_size, 'BIGTIFF=IF_SAFER']
+    if _PROFILES[profile] != 'NONE':
+        options += ['COMPRESS=%s' % _PROFILES[profile], 'PREDICTOR=%d' % _predictor(_gdal_datatype(datatype))]
+    return options
+
+
+def _overview_levels(width, height, block_size):
+    """
+        the overview factors down to the level fitting in one tile
+    """
+    levels, size = [], max(width, height)
+    while size > block_size:
+        size = -(-size // 2)
+        levels.append(2 ** (len(levels) + 1))
+    return levels
+
+
+def _build_overviews(dataset, levels, resampling='nearest', workers=None):
+    """
+        build the overviews of a dataset, GDAL computes the levels with workers threads
+    """
+    old_threads = gdal.GetConfigOption('GDAL_NUM_THREADS')
+    gdal.SetConfigOption('GDAL_NUM_THREADS', str(workers) if workers else 'ALL_CPUS')
+    try:
+        dataset.BuildOverviews(resampling.upper(), list(levels))
+    finally:
+        gdal.SetConfigOption('GDAL_NUM_THREADS', old_threads)
+
+
+class TiledWriter(object):
+    """
+        write tiles in any order into a tiled, compressed GeoTIFF.
+        Peak memory is bounded by the GDAL block cache (gdal.SetCacheMax), not by the image size.
+        With the 'cog' profile the tiles go into a temporary GeoTIFF next to the output; on close its
+        overviews are built in parallel and it is copied into a Cloud-Optimized GeoTIFF, so a reader can
+        fetch one tile of any zoom level with one small read.
+    :param filename: the path of output image
+    :param width: the number of columns
+    :param height: the number of rows
+    :param bands: the number of bands
+    :param datatype: numpy dtype or GDAL data type
+    :param im_proj: the projection, not set if None
+    :param im_geotrans: the geotransform, not set if None
+    :param block_size: the tile size of the output, a multiple of 16
+    :param compress: the compression of the output, used when profile is None and by the 'cog' profile
+    :param nodata: the nodata value of every band
+    :param profile: the output profile, see creation_options
+    :param overviews: list of overview levels, e.g. [2, 4, 8]; down to one tile for 'cog' if None
+    :param resampling: the resampling of overviews
+    :param workers: the number of threads building overviews, all CPUs if None
+    """
+    def __init__(self, filename, width, height, bands, datatype, im_proj, im_geotrans,
+                 block_size=256, compress='DEFLATE', nodata=None, profile=None, overviews=None,
+                 resampling='nearest', workers=None):
+        if profile is None:
+            profile = 'tiled' if not compress or compress.upper() == 'NONE' else compress.lower()
+        datatype = _gdal_datatype(datatype)
+        block_size = min(block_size, max(16, -(-max(width, height) // 16) * 16))  # 小图不必用大块
+        invalidate(filename)
+        self.filename = filename
+        self.profile = profile
+        self.block_size = block_size
+        self.compress = (compress or 'DEFLATE').upper()
+        self.overviews = overviews
+        self.resampling = resampling
+        self.workers = workers
+        if profile == 'cog':
+            self._path = filename + '.tmp.tif'
+            options = creation_options('tiled', datatype, block_size)
+        else:
+            self._path = filename
+            options = creation_options(profile, datatype, block_size)
+        driver = gdal.GetDriverByName("GTiff")
+        self.dataset = driver.Create(self._path, width, height, bands, datatype, options=options)
+        if im_geotrans is not None:
+            self.dataset.SetGeoTransform(im_geotrans)
+        if im_proj is not None:
+            self.dataset.SetProjection(im_proj)
+        if nodata is not None:
+            for i in range(bands):
+                self.dataset.GetRasterBand(i + 1).SetNoDataValue(nodata)
+
+    def write(self, xoff, yoff, data):
+        """
+            write a (bands, rows, cols) or (rows, cols) array at the pixel offset
+        """
+        if data.ndim == 2:
+            self.dataset.GetRasterBand(1).WriteArray(data, xoff, yoff)
+        else:
+            for i in range(data.shape[0]):
+                self.dataset.GetRasterBand(i + 1).WriteArray(data[i], xoff, yoff)
+
+    def close(self):
+        if self.dataset is None:
+            return
+        levels = self.overviews
+        if levels is None and self.profile == 'cog':
+            levels = _overview_levels(self.dataset.RasterXSize, self.dataset.RasterYSize, self.block_size)
+        if levels:
+            _build_overviews(self.dataset, levels, self.resampling, self.workers)
+        self.dataset.FlushCache()
+        if self.profile == 'cog':
+            options = ['COMPRESS=%s' % self.compress, 'BLOCKSIZE=%d' % self.block_size, 'BIGTIFF=IF_SAFER',
+                       'OVERVIEWS=%s' % ('FORCE_USE_EXISTING' if levels else 'NONE'),
+                       'NUM_THREADS=%s' % (self.workers or 'ALL_CPUS')]
+            if self.compress != 'NONE':
+                options.append('PREDICTOR=YES')
+            gdal.Translate(self.filename, self.dataset, format='COG', creationOptions=options)
+        self.dataset = None
+        if self._path != self.filename:
+            gdal.GetDriverByName("GTiff").Delete(self._path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+_RESAMPLING = ('nearest', 'bilinear', 'cubic', 'cubicspline', 'lanczos', 'average', 'mode')
+
+
+def resample(source_file, target_file, scale=5., resampling='nearest', workers=4, block_size=256,
+             compress='DEFLATE', overviews=None, profile=None):
+    """
+        resample an image block by block in a thread pool. The kernel is applied by a VRT on read, so
+        every output block only reads the source pixels it needs. Band statistics are accumulated while
+        writing, overviews are built as an optional last stage.
     :param source_file: the path of source file
     :param target_file: the path of target file
     :param scale: pixel scaling
+    :param resampling: nearest, bilinear, cubic, cubicspline, lanczos, average or mode
+    :param workers: the number of threads
+    :param block_size: the tile size of the output
+    :param compress: the compression of the output
+    :param overviews: list of overview levels, e.g. [2, 4, 8], no overviews if None (automatic for 'cog')
+    :param profile: the output profile, see creation_options; follows compress if None
     :return: None
     """
-    dataset = gdal.Open(source_file, gdalconst.GA_ReadOnly)
-    band_count = dataset.RasterCount  # 波段数
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
 
-    if band_count == 0 or not scale > 0:
-        print("参数异常")
-        return
-
-    cols = dataset.RasterXSize  # 列数
-    rows = dataset.RasterYSize  # 行数
-    cols = int(cols * scale)  # 计算新的行列数
-    rows = int(rows * scale)
+    dataset = open_raster(source_file)
+    band_count = dataset.RasterCount  # 波段数
+    if band_count == 0 or not scale > 0 or resampling not in _RESAMPLING:
+        raise ValueError("invalid parameters: %d bands, scale %r, resampling %r" % (band_count, scale, resampling))
 
+    cols = int(dataset.RasterXSize * scale)  # 计算新的行列数
+    rows = int(dataset.RasterYSize * scale)
     geotrans = list(dataset.GetGeoTransform())
-    print(dataset.GetGeoTransform())
-    print(geotrans)
     geotrans[1] = geotrans[1] / scale  # 像元宽度变为原来的scale倍
     geotrans[5] = geotrans[5] / scale  # 像元高度变为原来的scale倍
-    print(geotrans)
+    nodata = dataset.GetRasterBand(1).GetNoDataValue()
 
     if os.path.exists(target_file) and os.path.isfile(target_file):  # 如果已存在同名影像
         os.remove(target_file)  # 则删除之
 
-    band1 = dataset.GetRasterBand(1)
-    data_type = band1.DataType
-    target = dataset.GetDriver().Create(target_file, xsize=cols, ysize=rows, bands=band_count,
-                                        eType=data_type)
-    target.SetProjection(dataset.GetProjection())  # 设置投影坐标
-    target.SetGeoTransform(geotrans)  # 设置地理变换参数
-    total = band_count + 1
-    for index in range(1, total):
-        # 读取波段数据
-        print("正在写入" + str(index) + "波段")
-        data = dataset.GetRasterBand(index).ReadAsArray(buf_xsize=cols, buf_ysize=rows)
-        out_band = target.GetRasterBand(index)
-        # out_band.SetNoDataValue(dataset.GetRasterBand(index).GetNoDataValue())
-        out_band.WriteArray(data)  # 写入数据到新影像中
-        out_band.FlushCache()
-        out_band.ComputeBandStats(False)  # 计算统计信息
-    print("正在写入完成")
+    vrt = '/vsimem/resample_%d_%d.vrt' % (os.getpid(), id(dataset))
+    gdal.Translate(vrt, dataset, format='VRT', width=cols, height=rows, resampleAlg=resampling)
+    writer = TiledWriter(target_file, cols, rows, band_count, dataset.GetRasterBand(1).DataType,
+                         dataset.GetProjection(), geotrans, block_size=block_size, compress=compress,
+                         nodata=nodata, profile=profile, overviews=overviews, resampling=resampling, workers=workers)
     del dataset
 
+    local = threading.local()
+    lock = threading.Lock()
+    # 每个波段的 min, max, sum, sum of squares, count
+    stats = [[np.inf, -np.inf, 0., 0., 0] for _ in range(band_count)]
+
+    def process(windows):
+        if not hasattr(local, 'dataset'):
+            local.dataset = gdal.Open(vrt)
+        window = windows[1]
+        with timer('resample', 'read') as t:
+            data = local.dataset.ReadAsArray(*window).reshape(band_count, window[3], window[2])
+            t.add(data[0].size, data.nbytes)
+        with timer('resample', 'compute', data[0].size, data.nbytes):
+            block_stats = []
+            for band in data:
+                valid = band[band != nodata] if nodata is not None else band.ravel()
+                if valid.size == 0:
+                    block_stats.append(None)
+                    continue
+                valid = valid.astype(np.float64)
+                block_stats.append((valid.min(), valid.max(), valid.sum(), np.square(valid).sum(), valid.size))
+        with lock, timer('resample', 'write', data[0].size, data.nbytes):
+            writer.write(window[0], window[1], data)
+            for acc, bs in zip(stats, block_stats):
+                if bs is None:
+                    continue
+                acc[0] = min(acc[0], bs[0])
+                acc[1] = max(acc[1], bs[1])
+                acc[2] += bs[2]
+                acc[3] += bs[3]
+                acc[4] += bs[4]
+
+    windows = list(iter_windows(writer.dataset, block_size=(block_size, block_size)))
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for done, _ in enumerate(executor.map(process, windows)):
+                progress('resample', done + 1, len(windows))
+    finally:
+        gdal.Unlink(vrt)
+
+    for index, acc in enumerate(stats):
+        if acc[4] == 0:
+            continue
+        mean = acc[2] / acc[4]
+        std = max(acc[3] / acc[4] - mean * mean, 0.) ** 0.5
+        writer.dataset.GetRasterBand(index + 1).SetStatistics(float(acc[0]), float(acc[1]), mean, std)
+    with timer('resample', 'write'):
+        writer.close()
+
+
+def image_resampling(source_file, target_file, scale=5., profile='deflate'):
+    """
+          image resampling
+    :param source_file: the path of source file
+    :param target_file: the path of target file
+    :param scale: pixel scaling
+    :param profile: the output profile, see creation_options
+    :return: None
+    """
+    resample(source_file, target_file, scale, profile=profile)
+
+
+_CHIP_DATASET = None
+
+
+def _chip_worker_init(tif):
+    """
+        open the image once per worker process
+    """
+    global _CHIP_DATASET
+    _CHIP_DATASET = open_raster(tif)
+
+
+def _read_chip(window):
+    return _read_window_padded(_CHIP_DATASET, *window)
+
+
+def _read_window_padded(dataset, xoff, yoff, xsize, ysize):
+    """
+        read a (bands, ysize, xsize) window, the part outside the image is filled with zeros
+    """
+    bands = dataset.RasterCount
+    dtype = ga.GDALTypeCodeToNumericTypeCode(dataset.GetRasterBand(1).DataType)
+    out = np.zeros((bands, ysize, xsize), dtype=dtype)
+    x0, y0 = max(0, xoff), max(0, yoff)
+    x1, y1 = min(dataset.RasterXSize, xoff + xsize), min(dataset.RasterYSize, yoff + ysize)
+    if x1 > x0 and y1 > y0:
+        data = dataset.ReadAsArray(x0, y0, x1 - x0, y1 - y0)
+        out[:, y0 - yoff:y1 - yoff, x0 - xoff:x1 - xoff] = data.reshape(bands, y1 - y0, x1 - x0)
+    return out
+
 
-def sample_clip(shp, tif, outputdir, sampletype, size, fieldName='cls', n=None):
+def _iter_chips(tif, windows, workers):
+    """
+        yield the chips of the windows in order, reading them in a process pool if workers > 1
+    """
+    pool = dataset = None
+    if workers is None or workers <= 1:
+        dataset = open_raster(tif)
+        chips = (_read_window_padded(dataset, *window) for window in windows)
+    else:
+        from multiprocessing import Pool
+        pool = Pool(workers, initializer=_chip_worker_init, initargs=(tif,))
+        chips = pool.imap(_read_chip, windows, chunksize=64)
+    try:
+        for k in range(len(windows)):
+            with timer('sample_chips', 'read', 1) as t:
+                chip = next(chips)
+                t.add(nbytes=chip.nbytes)
+            yield chip
+            progress('sample_chips', k + 1, len(windows))
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        del dataset
+
+
+def _chip_footprint(geotrans, xoff, yoff, size):
+    x1 = geotrans[0] + xoff * geotrans[1]
+    y1 = geotrans[3] + yoff * geotrans[5]
+    x2 = x1 + size * geotrans[1]
+    y2 = y1 + size * geotrans[5]
+    return ogr.CreateGeometryFromWkt(
+        "POLYGON (({0} {1},{2} {1},{2} {3},{0} {3},{0} {1}))".format(x1, y1, x2, y2))
+
+
+def sample_chips(shp, tif, output, size, container='npy', workers=None, n=1, fieldName='cls', sampletype='poly',
+                 profile='deflate'):
+    """
+        generate image chips centred on the sampling points. The image and the points are opened once
+        (once per worker), chips are read in a process pool and numbered in the order of the points.
+    :param shp: the path of shape file of sampling points
+    :param tif: the path of image
+    :param output: the container of chips.
+                'npy': a .npy file holding a (chips, bands, size, size) memmap
+                'gtiff': a tiled GeoTIFF with the chips laid out in a grid, one chip per tile if size is a multiple of 16
+                'dirs': one directory per chip with its GeoTIFF and footprint shapefile (sample_clip layout)
+            for 'npy' and 'gtiff' the chip footprints are written to a GeoPackage next to it
+    :param size: the size of image chips
+    :param container: 'npy', 'gtiff' or 'dirs'
+    :param workers: the number of worker processes, read in the current process if None
+    :param n: the start number
+    :param fieldName: the name of field copied from the points into the footprints
+    :param sampletype: line or polygon, the geometry of the footprint shapefiles in 'dirs'
+    :param profile: the output profile of the GeoTIFFs of 'gtiff' and 'dirs', see creation_options
+    :return: the next number
+    """
+    size = int(size)
+    info = raster_info(tif)
+    im_geotrans = info['geotransform']
+    im_proj = info['projection']
+    bandscount = info['bands']
+    datatype = info['datatypes'][0]
+    dtype = info['dtypes'][0]
+
+    dsshp = open_vector(shp)
+    layer = dsshp.GetLayer()
+    srs = layer.GetSpatialRef()
+    has_field = layer.GetLayerDefn().GetFieldIndex(fieldName) >= 0
+    windows, labels = [], []
+    for feature in layer:
+        geometry = feature.GetGeometryRef()
+        xoff = int((geometry.GetX() - size / 2. * im_geotrans[1] - im_geotrans[0]) / im_geotrans[1])
+        yoff = int((geometry.GetY() - size / 2. * im_geotrans[5] - im_geotrans[3]) / im_geotrans[5])
+        windows.append((xoff, yoff, size, size))
+        labels.append(feature.GetField(fieldName) if has_field else None)
+    del dsshp
+    count = len(windows)
+
+    if container == 'dirs':
+        shp_driver = ogr.GetDriverByName("ESRI Shapefile")
+        line = "line" in sampletype.lower()
+        for k, chip in enumerate(_iter_chips(tif, windows, workers)):
+            dirname = "%08d" % (n + k)
+            dirpath = os.path.join(output, dirname + "_V1")
+            if not os.path.exists(dirpath):
+                os.mkdir(dirpath)
+            xoff, yoff = windows[k][:2]
+            newform = list(im_geotrans)
+            newform[0] = im_geotrans[0] + xoff * im_geotrans[1]
+            newform[3] = im_geotrans[3] + yoff * im_geotrans[5]
+            with timer('sample_chips', 'write', 1, chip.nbytes), \
+                    TiledWriter(os.path.join(dirpath, dirname + ".tif"), size, size, bandscount, datatype, im_proj,
+                                tuple(newform), profile=profile) as writer:
+                writer.write(0, 0, chip)
+
+            shpname = dirname + ("_V1_LINE.shp" if line else "_V1_POLY.shp")
+            oDS = shp_driver.CreateDataSource(os.path.join(dirpath, shpname))
+            oLayer = oDS.CreateLayer("TestPolygon", srs, ogr.wkbLineString if line else ogr.wkbPolygon)
+            oFieldName = ogr.FieldDefn(fieldName, ogr.OFTString)
+            oFieldName.SetWidth(50)
+            oLayer.CreateField(oFieldName, 1)
+            oFeature = ogr.Feature(oLayer.GetLayerDefn())
+            footprint = _chip_footprint(im_geotrans, xoff, yoff, size)
+            oFeature.SetGeometry(footprint.GetGeometryRef(0) if line else footprint)
+            if labels[k] is not None:
+                oFeature.SetField(fieldName, str(labels[k]))
+            oLayer.CreateFeature(oFeature)
+            oDS = None
+        return n + count
+
+    if container == 'npy':
+        chips = np.lib.format.open_memmap(output, mode='w+', dtype=dtype, shape=(count, bandscount, size, size))
+        for k, chip in enumerate(_iter_chips(tif, windows, workers)):
+            with timer('sample_chips', 'write', 1, chip.nbytes):
+                chips[k] = chip
+        chips.flush()
+        del chips
+    elif container == 'gtiff':
+        ncols = max(1, int(np.ceil(np.sqrt(count))))
+        nrows = max(1, -(-count // ncols))
+        with TiledWriter(output, ncols * size, nrows * size, bandscount, datatype, None, None,
+                         block_size=size if size % 16 == 0 else 256, profile=profile) as writer:
+            for k, chip in enumerate(_iter_chips(tif, windows, workers)):
+                with timer('sample_chips', 'write', 1, chip.nbytes):
+                    writer.write((k % ncols) * size, (k // ncols) * size, chip)
+    else:
+        raise ValueError("unknown container: %s" % container)
+
+    # 切片范围写入GeoPackage，chip_id与容器中的序号一致
+    with LayerWriter(os.path.splitext(output)[0] + "_chips.gpkg", srs, ogr.wkbPolygon, layer_name="chips") as writer:
+        writer.add_field(ogr.FieldDefn("chip_id", ogr.OFTInteger))
+        writer.add_field(ogr.FieldDefn(fieldName, ogr.OFTString))
+        for k, window in enumerate(windows):
+            writer.write(_chip_footprint(im_geotrans, window[0], window[1], size),
+                         values={"chip_id": n + k, fieldName: None if labels[k] is None else str(labels[k])})
+    return n + count
+
+
+def sample_clip(shp, tif, outputdir, sampletype, size, fieldName='cls', n=None, profile='deflate'):
     """
         according to sampling point, generating image slices
     :param shp: the path of shape file
@@ -133,161 +683,174 @@ def sample_clip(shp, tif, outputdir, sampletype, size, fieldName='cls', n=None):
     :param size:  the size of images slices
     :param fieldName: the name of field
     :param n: the start number
+    :param profile: the output profile of the chips, see creation_options
     :return:
     """
-    time1 = time.clock()
-
-    gdal.AllRegister()
-    lc = gdal.Open(tif)
-    im_width = lc.RasterXSize
-    im_height = lc.RasterYSize
-    im_geotrans = lc.GetGeoTransform()
-    bandscount = lc.RasterCount
-    im_proj = lc.GetProjection()
-    print(im_width, im_height)
-    gdal.AllRegister()
-    gdal.SetConfigOption("gdal_FILENAME_IS_UTF8", "YES")
-
-    driver = ogr.GetDriverByName('ESRI Shapefile')
-    dsshp = driver.Open(shp, 0)
-    if dsshp is None:
-        print('Could not open ' + 'sites.shp')
-        sys.exit(1)
-    layer = dsshp.GetLayer()
-    xValues = []
-    yValues = []
-    m = layer.GetFeatureCount()
-    feature = layer.GetNextFeature()
-    print("tif_bands:{0},samples_nums:{1},sample_type:{2},sample_size:{3}*{3}".format(bandscount, m, sampletype,
-                                                                                      int(size)))
-
-    if n is not None:
-        pass
-    else:
+    if n is None:
         n = 1
-    while feature:
-        if n < 10:
-            dirname = "0000000" + str(n)
-        elif n >= 10 and n < 100:
-            dirname = "000000" + str(n)
-        elif n >= 100 and n > 1000:
-            dirname = "00000" + str(n)
-        else:
-            dirname = "0000" + str(n)
-
-        # print dirname
-        dirpath = os.path.join(outputdir, dirname + "_V1")
-        if not os.path.exists(dirpath):
-            os.mkdir(dirpath)
-        tifname = dirname + ".tif"
-        if "poly" in sampletype or "POLY" in sampletype:
-            shpname = dirname + "_V1_POLY.shp"
-        if "line" in sampletype or "LINE" in sampletype:
-            shpname = dirname + "_V1_LINE.shp"
-        geometry = feature.GetGeometryRef()
-        x = geometry.GetX()
-        y = geometry.GetY()
-        print(x, y)
-        print(im_geotrans)
-        xValues.append(x)
-        yValues.append(y)
-        newform = []
-        newform = list(im_geotrans)
-        # print newform
-        newform[0] = x - im_geotrans[1] * int(size) / 2.0
-        newform[3] = y - im_geotrans[5] * int(size) / 2.0
-        print(newform[0], newform[3])
-        newformtuple = tuple(newform)
-        x1 = x - int(size) / 2 * im_geotrans[1]
-        y1 = y - int(size) / 2 * im_geotrans[5]
-        x2 = x + int(size) / 2 * im_geotrans[1]
-        y2 = y - int(size) / 2 * im_geotrans[5]
-        x3 = x - int(size) / 2 * im_geotrans[1]
-        y3 = y + int(size) / 2 * im_geotrans[5]
-        x4 = x + int(size) / 2 * im_geotrans[1]
-        y4 = y + int(size) / 2 * im_geotrans[5]
-        Xpix = (x1 - im_geotrans[0]) / im_geotrans[1]
-        # Xpix=(newform[0]-im_geotrans[0])
-
-        Ypix = (newform[3] - im_geotrans[3]) / im_geotrans[5]
-        # Ypix=abs(newform[3]-im_geotrans[3])
-        print("#################")
-        print(Xpix, Ypix)
-
-        # **************create tif**********************
-        # print"start creating {0}".format(tifname)
-        pBuf = None
-        pBuf = lc.ReadAsArray(int(Xpix), int(Ypix), int(size), int(size))
-        # print pBuf.dtype.name
-        driver = gdal.GetDriverByName("GTiff")
-        create_option = []
-        if 'int8' in pBuf.dtype.name:
-            datatype = gdal.GDT_Byte
-        elif 'int16' in pBuf.dtype.name:
-            datatype = gdal.GDT_UInt16
-        else:
-            datatype = gdal.GDT_Float32
-        outtif = os.path.join(dirpath, tifname)
-        ds = driver.Create(outtif, int(size), int(size), int(bandscount), datatype, options=create_option)
-        if ds == None:
-            print("2222")
-        ds.SetProjection(im_proj)
-        ds.SetGeoTransform(newformtuple)
-        ds.FlushCache()
-        if bandscount > 1:
-            for i in range(int(bandscount)):
-                outBand = ds.GetRasterBand(i + 1)
-                outBand.WriteArray(pBuf[i])
-        else:
-            outBand = ds.GetRasterBand(1)
-            outBand.WriteArray(pBuf)
-        ds.FlushCache()
-        # print "creating {0} successfully".format(tifname)
-        # **************create shp**********************
-        # print"start creating shps"
-        gdal.SetConfigOption("GDAL_FILENAME_IS_UTF8", "NO")
-        gdal.SetConfigOption("SHAPE_ENCODING", "")
-        strVectorFile = os.path.join(dirpath, shpname)
-        ogr.RegisterAll()
-        driver = ogr.GetDriverByName('ESRI Shapefile')
-        ds = driver.Open(shp)
-        layer0 = ds.GetLayerByIndex(0)
-        prosrs = layer0.GetSpatialRef()
-        # geosrs = osr.SpatialReference()
-
-        oDriver = ogr.GetDriverByName("ESRI Shapefile")
-        if oDriver == None:
-            print("1")
-            return
+    return sample_chips(shp, tif, outputdir, size, container='dirs', n=n, fieldName=fieldName,
+                        sampletype=sampletype, profile=profile)
 
-        oDS = oDriver.CreateDataSource(strVectorFile)
-        if oDS == None:
-            print("2")
-            return
 
-        papszLCO = []
-        if "line" in sampletype or "LINE" in sampletype:
-            oLayer = oDS.CreateLayer("TestPolygon", prosrs, ogr.wkbLineString, papszLCO)
-        if "poly" in sampletype or "POLY" in sampletype:
-            oLayer = oDS.CreateLayer("TestPolygon", prosrs, ogr.wkbPolygon, papszLCO)
-        if oLayer == None:
-            print("3")
+def _tile_offsets(length, tile_size, stride):
+    offsets = list(range(0, max(length - tile_size, 0), stride))
+    offsets.append(max(length - tile_size, 0))  # 最后一行/列向内移动，保证瓦片完整
+    return offsets
+
+
+def sliding_windows(width, height, tile_size=512, overlap=64):
+    """
+        the windows of a sliding-window pass over an image
+    :param width: the number of columns
+    :param height: the number of rows
+    :param tile_size: the size of the square windows
+    :param overlap: the number of pixels shared by neighbouring windows
+    :return: list of (xoff, yoff, tile_size, tile_size); the last row and column are moved back inside the
+            image, the windows only go past the image when it is smaller than tile_size
+    """
+    stride = tile_size - overlap
+    if stride <= 0:
+        raise ValueError("overlap must be smaller than tile_size")
+    return [(x, y, tile_size, tile_size) for y in _tile_offsets(height, tile_size, stride)
+            for x in _tile_offsets(width, tile_size, stride)]
+
+
+def iter_tiles(filename, tile_size=512, overlap=64):
+    """
+        lazily read the overlapping tiles of an image for inference, one tile in memory at a time
+    :param filename: the path of image
+    :param tile_size: the size of the square tiles
+    :param overlap: the number of pixels shared by neighbouring tiles
+    :return: yields (window, geotrans, data): the pixel window, the geotransform of the tile and a
+            (bands, tile_size, tile_size) array, zero filled outside the image
+    """
+    dataset = open_raster(filename)
+    gt = dataset.GetGeoTransform()
+    for window in sliding_windows(dataset.RasterXSize, dataset.RasterYSize, tile_size, overlap):
+        xoff, yoff = window[:2]
+        geotrans = (gt[0] + xoff * gt[1] + yoff * gt[2], gt[1], gt[2],
+                    gt[3] + xoff * gt[4] + yoff * gt[5], gt[4], gt[5])
+        yield window, geotrans, _read_window_padded(dataset, *window)
+    del dataset
+
+
+def _blend_weights(size, overlap, blend):
+    """
+        the 1-D weights of a tile edge: flat for 'average', a raised cosine over the overlap for 'cosine'
+    """
+    weights = np.ones(size, dtype=np.float64)
+    if blend == 'cosine' and overlap > 0:
+        ramp = 0.5 - 0.5 * np.cos(np.pi * (np.arange(min(overlap, size)) + 0.5) / overlap)
+        weights[:ramp.size] = ramp
+        weights[size - ramp.size:] = np.minimum(weights[size - ramp.size:], ramp[::-1])
+    return weights
+
+
+class MosaicStitcher(object):
+    """
+        stitch prediction tiles of sliding_windows back into one tiled raster, blending the overlaps.
+        The image is cut into cells along the window edges; a cell is accumulated until every window
+        covering it has been added, then normalized and written, so only the cells of the windows in
+        flight are held in memory. add() may be called from several threads and in any order.
+    :param filename: the path of output raster
+    :param template: the path of the image that was tiled, gives size, geotransform and projection
+    :param bands: the number of bands of the predictions
+    :param datatype: numpy dtype or GDAL data type of output
+    :param tile_size: the tile_size given to sliding_windows/iter_tiles
+    :param overlap: the overlap given to sliding_windows/iter_tiles
+    :param blend: 'average', 'max' or 'cosine' (average weighted by a raised cosine over the overlap)
+    :param profile: the output profile, see creation_options
+    :param nodata: the nodata value of output, also written for pixels no tile was added for; no nodata
+            is set if None (class 0 of a label map stays a class) and such pixels are 0
+    """
+    def __init__(self, filename, template, bands=1, datatype=np.float32, tile_size=512, overlap=64,
+                 blend='average', profile='deflate', nodata=None):
+        import bisect
+        import threading
+
+        if blend not in ('average', 'max', 'cosine'):
+            raise ValueError("unknown blend: %s" % blend)
+        info = raster_info(template)
+        self.width, self.height = info['width'], info['height']
+        self.writer = TiledWriter(filename, self.width, self.height, bands, datatype, info['projection'],
+                                  info['geotransform'], profile=profile, nodata=nodata)
+        self.bands = bands
+        self.dtype = ga.GDALTypeCodeToNumericTypeCode(_gdal_datatype(datatype))
+        self.blend = blend
+        self.nodata = nodata
+        self._lock = threading.Lock()
+        self._weights = _blend_weights(tile_size, overlap, blend)
+
+        windows = [self._clip(window) for window in sliding_windows(self.width, self.height, tile_size, overlap)]
+        xs = sorted({v for x, _, w, _ in windows for v in (x, x + w)})
+        ys = sorted({v for _, y, _, h in windows for v in (y, y + h)})
+        self._cells = {}  # (x0, y0, x1, y1) -> [剩余窗口数, 累加值, 权重和]
+        self._window_cells = {}
+        for window in windows:
+            x, y, w, h = window
+            i0, i1 = bisect.bisect_left(xs, x), bisect.bisect_left(xs, x + w)
+            j0, j1 = bisect.bisect_left(ys, y), bisect.bisect_left(ys, y + h)
+            cells = [(xs[i], ys[j], xs[i + 1], ys[j + 1]) for j in range(j0, j1) for i in range(i0, i1)]
+            self._window_cells[window[:2]] = cells
+            for cell in cells:
+                self._cells.setdefault(cell, [0, None, None])[0] += 1
+
+    def _clip(self, window):
+        x, y, w, h = window
+        return x, y, min(w, self.width - x), min(h, self.height - y)
+
+    def add(self, window, data):
+        """
+            add the prediction of one window
+        :param window: the window from sliding_windows/iter_tiles
+        :param data: (bands, rows, cols) or (rows, cols) array of the size of the window
+        """
+        data = np.asarray(data).reshape(self.bands, window[3], window[2])
+        x, y = window[:2]
+        weights = np.outer(self._weights[:window[3]], self._weights[:window[2]])
+        with self._lock:
+            for cell in self._window_cells[(x, y)]:
+                x0, y0, x1, y1 = cell
+                part = data[:, y0 - y:y1 - y, x0 - x:x1 - x].astype(np.float64)
+                state = self._cells[cell]
+                if self.blend == 'max':
+                    state[1] = part if state[1] is None else np.maximum(state[1], part)
+                    state[2] = 1.
+                else:
+                    w = weights[y0 - y:y1 - y, x0 - x:x1 - x]
+                    state[1] = part * w if state[1] is None else state[1] + part * w
+                    state[2] = w.copy() if state[2] is None else state[2] + w
+                state[0] -= 1
+                if state[0] == 0:
+                    self._flush(cell)
+
+    def _flush(self, cell):
+        _, total, weight = self._cells.pop(cell)
+        x0, y0, x1, y1 = cell
+        if total is None:
+            out = np.full((self.bands, y1 - y0, x1 - x0), self.nodata if self.nodata is not None else 0,
+                          dtype=self.dtype)
+        else:
+            out = total / weight if self.blend != 'max' else total
+            if np.issubdtype(self.dtype, np.integer):
+                out = np.rint(out)
+            out = out.astype(self.dtype)
+        self.writer.write(x0, y0, out)
+
+    def close(self):
+        """
+            write the cells still waiting for windows that were never added, then close the output
+        """
+        if self.writer is None:
             return
+        with self._lock:
+            for cell in list(self._cells):
+                self._flush(cell)
+            self.writer.close()
+            self.writer = None
+
+    def __enter__(self):
+        return self
 
-        oFieldName = ogr.FieldDefn(fieldName, ogr.OFTString)
-        oFieldName.SetWidth(50)
-        oLayer.CreateField(oFieldName, 1)
-        oDefn = oLayer.GetLayerDefn()
-        oFeatureRectangle = ogr.Feature(oDefn)
-
-        geomRectangle = ogr.CreateGeometryFromWkt(
-            "POLYGON (({0} {1},{2} {3},{4} {5},{6} {7},{0} {1}))".format(x1, y1, x2, y2, x4, y4, x3, y3))
-        oFeatureRectangle.SetGeometry(geomRectangle)
-        oLayer.CreateFeature(oFeatureRectangle)
-        print("{0} ok".format(dirname))
-        n = n + 1
-        feature = layer.GetNextFeature()
-    time2 = time.clock()
-    print('Process Running time: %s min' % ((time2 - time1) / 60))
-
-    return n
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -1,51 +1,168 @@
-import os
-from osgeo import gdal, gdalconst, ogr
-import geopandas as gpd
-from shapely.geometry import Polygon, mapping
+import numpy as np
+from osgeo import gdal, ogr
+from .datasetCache import open_vector, raster_info
+from .instrumentation import progress, timer
+from .rasterTools import TiledWriter
+from .vectorPipeline import VectorPipeline
 
 
-def line2pol(in_shp, out_shp):
+def line2pol(in_shp, out_shp, workers=None, batch_size=65536):
     """
-        convert multiLine to polygon
+        convert multiLine to polygon. The lines are streamed in batches and converted as coordinate
+        arrays; unclosed rings are closed and multipart lines are polygonized.
     :param in_shp: the path of input shapefile
     :param out_shp: the path of output shapefile
+    :param workers: the number of worker processes, convert in the current process if None
+    :param batch_size: the number of features in one batch
     :return:
     """
-    gdf = gpd.read_file(in_shp) #LINESTRING
-    gdf['geometry'] = [Polygon(mapping(x)['coordinates']) for x in gdf.geometry]
-    gdf.to_file(out_shp, driver="ESRI Shapefile")
+    VectorPipeline(in_shp, workers=workers, batch_size=batch_size).line_to_polygon().write(out_shp)
 
 
-def pol2line(polyfn, linefn):
+def pol2line(polyfn, linefn, interiors=True, dedupe=False, workers=None):
     """
         This function is used to make polygon convert to line
     :param polyfn: the path of input, the shapefile of polygon
     :param linefn: the path of output, the shapefile of line
+    :param interiors: write the interior rings too, not only the exterior ones
+    :param dedupe: union all rings so that an edge shared by two polygons is written once, and merge
+            the result into maximal lines; the attributes are dropped
+    :param workers: the number of worker processes, each converts a range of FIDs
     :return:
     """
-    driver = ogr.GetDriverByName('ESRI Shapefile')
-    polyds = ogr.Open(polyfn, 0)
-    polyLayer = polyds.GetLayer()
-    spatialref = polyLayer.GetSpatialRef()
-    #创建输出文件
-    if os.path.exists(linefn):
-        driver.DeleteDataSource(linefn)
-    lineds =driver.CreateDataSource(linefn)
-    linelayer = lineds.CreateLayer(linefn, srs=spatialref, geom_type=ogr.wkbLineString)
-    featuredefn = linelayer.GetLayerDefn()
-    #获取ring到几何体
-    #geomline = ogr.Geometry(ogr.wkbGeometryCollection)
-    for feat in polyLayer:
-        geom = feat.GetGeometryRef()
-        ring = geom.GetGeometryRef(0)
-        #geomcoll.AddGeometry(ring)
-        outfeature = ogr.Feature(featuredefn)
-        outfeature.SetGeometry(ring)
-        linelayer.CreateFeature(outfeature)
-        outfeature = None
-
-
-def shp2Raster(shp, templatePic, output, nodata, field=None):
+    pipeline = VectorPipeline(polyfn, workers=workers).polygon_to_line(interiors)
+    if dedupe:
+        pipeline.dissolve().merge_lines().explode()
+    pipeline.write(linefn)
+
+
+_INTEGER_TYPES = [(gdal.GDT_Byte, 0, 255), (gdal.GDT_UInt16, 0, 65535), (gdal.GDT_Int16, -32768, 32767),
+                  (gdal.GDT_UInt32, 0, 4294967295), (gdal.GDT_Int32, -2147483648, 2147483647)]
+
+
+def _auto_datatype(vector, fields, burn_value, nodata):
+    """
+        the smallest GDAL data type holding the burnt values and nodata
+    """
+    layer = vector.GetLayer()
+    values = [nodata]
+    if not fields:
+        values.append(burn_value)
+    is_integer = all(float(v).is_integer() for v in values)
+    defn = layer.GetLayerDefn()
+    for field in fields:
+        field_type = defn.GetFieldDefn(defn.GetFieldIndex(field)).GetType()
+        if field_type not in (ogr.OFTInteger, ogr.OFTInteger64):
+            is_integer = False
+        sql = 'SELECT MIN("{0}"), MAX("{0}") FROM "{1}"'.format(field, layer.GetName())
+        result = vector.ExecuteSQL(sql)
+        feature = result.GetNextFeature()
+        values += [feature.GetField(0), feature.GetField(1)]
+        vector.ReleaseResultSet(result)
+    values = [v for v in values if v is not None]
+    if is_integer:
+        for datatype, lo, hi in _INTEGER_TYPES:
+            if lo <= min(values) and max(values) <= hi:
+                return datatype
+    return gdal.GDT_Float32 if max(abs(v) for v in values) < 3.4e38 else gdal.GDT_Float64
+
+
+def _rasterize_tile(args):
+    """
+        rasterize the features intersecting one tile into a (bands, rows, cols) array, None if there is none
+    """
+    shp, window, geotrans, proj, fields, burn_value, nodata, datatype, all_touched = args
+    xoff, yoff, xsize, ysize = window
+    x_min = geotrans[0] + xoff * geotrans[1]
+    y_max = geotrans[3] + yoff * geotrans[5]
+    x_max = x_min + xsize * geotrans[1]
+    y_min = y_max + ysize * geotrans[5]
+
+    vector = open_vector(shp)
+    layer = vector.GetLayer()
+    layer.SetSpatialFilterRect(min(x_min, x_max), min(y_min, y_max), max(x_min, x_max), max(y_min, y_max))
+    # Shapefile 没有 .qix 时 GetFeatureCount 会扫描整个图层，取第一个要素即可判断
+    layer.ResetReading()
+    if layer.GetNextFeature() is None:
+        return None
+    layer.ResetReading()
+
+    bands = len(fields) if fields else 1
+    tile = gdal.GetDriverByName('MEM').Create('', xsize, ysize, bands, datatype)
+    tile.SetGeoTransform((x_min, geotrans[1], geotrans[2], y_max, geotrans[4], geotrans[5]))
+    tile.SetProjection(proj)
+    options = ['ALL_TOUCHED=TRUE'] if all_touched else []
+    for i in range(bands):
+        tile.GetRasterBand(i + 1).Fill(nodata)
+        if fields:
+            gdal.RasterizeLayer(tile, [i + 1], layer, options=options + ['ATTRIBUTE=%s' % fields[i]])
+        else:
+            gdal.RasterizeLayer(tile, [i + 1], layer, burn_values=[burn_value], options=options)
+    return tile.ReadAsArray().reshape(bands, ysize, xsize)
+
+
+def rasterize(shp, templatePic, output, nodata=0, fields=None, burn_value=1, all_touched=True, datatype=None,
+              tile_size=1024, workers=None, compress='DEFLATE', profile=None):
+    """
+        rasterize a shapefile on the grid of a template raster, tile by tile. Each tile only reads the
+        features intersecting it (spatial filter), tiles can run in worker processes and are written
+        into a tiled, compressed GeoTIFF. The spatial filter only avoids reading the whole shapefile
+        for every tile when it has a .qix spatial index, create one first for large inputs with
+        ogrinfo file.shp -sql "CREATE SPATIAL INDEX ON file".
+    :param shp: the path of shapefile
+    :param templatePic: the template raster giving size, geotransform and projection
+    :param output: the path of output raster
+    :param nodata: the value of pixels not covered by any feature
+    :param fields: a field name or a list of field names, one output band per field;
+            burn_value into one band if None
+    :param burn_value: the value burnt when no field is given
+    :param all_touched: burn every pixel touched by a feature, not only the ones whose centre is inside
+    :param datatype: the GDAL data type of output, the smallest type holding the values if None
+    :param tile_size: the size of tiles in pixels
+    :param workers: the number of worker processes, rasterize in the current process if None
+    :param compress: the compression of output
+    :param profile: the output profile (gdalTools.creation_options), follows compress if None
+    :return:
+    """
+    if isinstance(fields, str):
+        fields = [fields]
+    template = raster_info(templatePic)
+    geotrans = template['geotransform']
+    proj = template['projection']
+    width, height = template['width'], template['height']
+    if datatype is None:
+        datatype = _auto_datatype(open_vector(shp), fields or [], burn_value, nodata)
+
+    bands = len(fields) if fields else 1
+    windows = [(x, y, min(tile_size, width - x), min(tile_size, height - y))
+               for y in range(0, height, tile_size) for x in range(0, width, tile_size)]
+    tasks = [(shp, window, geotrans, proj, fields, burn_value, nodata, datatype, all_touched) for window in windows]
+    block_size = min(512, max(16, tile_size // 16 * 16))
+    with TiledWriter(output, width, height, bands, datatype, proj, geotrans, block_size=block_size,
+                     compress=compress, nodata=nodata, profile=profile, workers=workers) as writer:
+        if workers is not None and workers > 1:
+            from multiprocessing import Pool
+            pool = Pool(workers)
+            results = pool.imap(_rasterize_tile, tasks)
+        else:
+            pool = None
+            results = map(_rasterize_tile, tasks)
+        try:
+            for k, window in enumerate(windows):
+                with timer('rasterize', 'compute', window[2] * window[3]):
+                    data = next(results)
+                if data is None:
+                    data = np.full((bands, window[3], window[2]), nodata)
+                with timer('rasterize', 'write', window[2] * window[3], data.nbytes):
+                    writer.write(window[0], window[1], data)
+                progress('rasterize', k + 1, len(windows))
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+
+def shp2Raster(shp, templatePic, output, nodata, field=None, profile='deflate'):
     """
         making shapefile convert to raster
     shp: String，the path of shapefile
@@ -54,34 +171,9 @@ def shp2Raster(shp, templatePic, output, nodata, field=None):
     output: String, the path of output shapefile
     field: the field of output you want
     nodata: The converted value of an integer or floating point vector blank
+    profile: the output profile, 'gtiff', 'tiled', 'deflate', 'zstd', 'lzw' or 'cog'
     """
-    ndsm = templatePic
-    data = gdal.Open(ndsm, gdalconst.GA_ReadOnly)
-    geo_transform = data.GetGeoTransform()
-    proj=data.GetProjection()
-    #source_layer = data.GetLayer()
-    # x_min = geo_transform[0]
-    # y_max = geo_transform[3]
-    # x_max = x_min + geo_transform[1] * data.RasterXSize
-    # y_min = y_max + geo_transform[5] * data.RasterYSize
-    x_res = data.RasterXSize
-    y_res = data.RasterYSize
-    mb_v = ogr.Open(shp)
-    mb_l = mb_v.GetLayer()
-    pixel_width = geo_transform[1]
     #输出影像为16位整型
-    target_ds = gdal.GetDriverByName('GTiff').Create(output, x_res, y_res, 1, gdal.GDT_Int16)
-
-    target_ds.SetGeoTransform(geo_transform)
-    target_ds.SetProjection(proj)
-    band = target_ds.GetRasterBand(1)
-    NoData_value = nodata
-    band.SetNoDataValue(NoData_value)
-    band.FlushCache()
-    if field is not None:
-        gdal.RasterizeLayer(target_ds, [1], mb_l, options=["ATTRIBUTE=%s"%field,'ALL_TOUCHED=TRUE'])
-    else:
-        gdal.RasterizeLayer(target_ds, [1], mb_l)
-
-    target_ds = None
-
+    # 不指定字段时与 gdal.RasterizeLayer 的默认值一致，烧录 255
+    rasterize(shp, templatePic, output, nodata, fields=field, burn_value=255, datatype=gdal.GDT_Int16,
+              profile=profile)
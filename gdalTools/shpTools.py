@@ -1,53 +1,188 @@
-from pathlib import Path
 from osgeo import ogr, gdal
+import copy
 import os
-import geopandas as pd
-from geopandas._vectorized import simplify
-import rasterio
-from rasterstats import zonal_stats
-import time
-import shutil
+import threading
+from collections import OrderedDict
+import numpy as np
+from .datasetCache import _evict, _stamp, invalidate, open_raster, open_vector, raster_info
+from .instrumentation import progress, timer
+from .layerWriter import _MULTI, LayerWriter, create_datasource
+from .shpConversion import pol2line
+from .vectorPipeline import VectorPipeline, _fid_ranges, _iter_wkb_batches, _read_fid_range
 
 
 def mkdir(path):
     if not os.path.exists(path):
         os.mkdir(path)
 
-def intersection(ShpA, ShpB, fname):
+
+class _GridIndex(object):
+    """
+        a uniform grid over feature envelopes, used to find candidate pairs by bounding box
+    :param envelopes: list of envelopes in OGR order (minX, maxX, minY, maxY)
+    :param cell_size: the size of grid cell, estimated from the envelopes if None
+    """
+    def __init__(self, envelopes, cell_size=None):
+        self.envelopes = list(envelopes)
+        self.cells = {}
+        if len(self.envelopes) == 0:
+            self.cell_size = 1.
+            return
+        if cell_size is None:
+            n = len(self.envelopes)
+            minx = min(e[0] for e in self.envelopes)
+            maxx = max(e[1] for e in self.envelopes)
+            miny = min(e[2] for e in self.envelopes)
+            maxy = max(e[3] for e in self.envelopes)
+            mean_size = sum(max(e[1] - e[0], e[3] - e[2]) for e in self.envelopes) / n
+            cell_size = max(mean_size, ((maxx - minx) * (maxy - miny) / n) ** 0.5)
+        self.cell_size = cell_size if cell_size > 0 else 1.
+        for i, env in enumerate(self.envelopes):
+            for key in self._keys(env):
+                self.cells.setdefault(key, []).append(i)
+        # 格网的范围，查询范围裁剪到这里，避免大范围要素遍历大量空格网
+        self.bounds = (min(k[0] for k in self.cells), max(k[0] for k in self.cells),
+                       min(k[1] for k in self.cells), max(k[1] for k in self.cells))
+
+    def _keys(self, env):
+        c = self.cell_size
+        for gx in range(int(env[0] // c), int(env[1] // c) + 1):
+            for gy in range(int(env[2] // c), int(env[3] // c) + 1):
+                yield gx, gy
+
+    def _query_keys(self, env):
+        if not self.cells:
+            return []
+        c = self.cell_size
+        x0, x1 = max(int(env[0] // c), self.bounds[0]), min(int(env[1] // c), self.bounds[1])
+        y0, y1 = max(int(env[2] // c), self.bounds[2]), min(int(env[3] // c), self.bounds[3])
+        if x0 > x1 or y0 > y1:
+            return []
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self.cells):
+            return [k for k in self.cells if x0 <= k[0] <= x1 and y0 <= k[1] <= y1]
+        return [(gx, gy) for gx in range(x0, x1 + 1) for gy in range(y0, y1 + 1)]
+
+    def query(self, env):
+        """
+            return the indexes of envelopes intersecting env, in insertion order
+        """
+        found = set()
+        for key in self._query_keys(env):
+            for i in self.cells.get(key, ()):
+                if i in found:
+                    continue
+                e = self.envelopes[i]
+                if e[0] <= env[1] and env[0] <= e[1] and e[2] <= env[3] and env[2] <= e[3]:
+                    found.add(i)
+        return sorted(found)
+
+
+def _keep_dimension(geom, dimension):
+    """
+        keep the parts of geom with the given dimension (0 point, 1 line, 2 polygon)
+    :return: the geometry, or None if nothing is left
+    """
+    if geom is None or geom.IsEmpty():
+        return None
+    if ogr.GT_Flatten(geom.GetGeometryType()) != ogr.wkbGeometryCollection:
+        return geom if geom.GetDimension() == dimension else None
+    parts = [geom.GetGeometryRef(i).Clone() for i in range(geom.GetGeometryCount())
+             if geom.GetGeometryRef(i).GetDimension() == dimension]
+    if len(parts) == 0:
+        return None
+    if len(parts) == 1:
+        return parts[0]
+    multi = ogr.Geometry({0: ogr.wkbMultiPoint, 1: ogr.wkbMultiLineString, 2: ogr.wkbMultiPolygon}[dimension])
+    for part in parts:
+        if ogr.GT_Flatten(part.GetGeometryType()) in (ogr.wkbMultiPoint, ogr.wkbMultiLineString, ogr.wkbMultiPolygon):
+            for j in range(part.GetGeometryCount()):
+                multi.AddGeometry(part.GetGeometryRef(j))
+        else:
+            multi.AddGeometry(part)
+    return multi
+
+
+def intersection(ShpA, ShpB, fname, keep_fields=True):
     """
     This function is used to get the intersection between shapefile A and shapefile B.
-    :param shpPath: the path of input shapefile A
-    :param roadShp: the path of input shapefile B
+    The smaller layer is loaded into a grid index, the bigger one is streamed, and only the pairs
+    whose bounding boxes overlap are intersected. Empty results are skipped.
+    :param ShpA: the path of input shapefile A
+    :param ShpB: the path of input shapefile B
     :param fname: the path of output shapefile
+    :param keep_fields: copy the attributes of both features into the output
     :return:
     """
-    driver = ogr.GetDriverByName("ESRI Shapefile")
-    dataSourceA = driver.Open(ShpA, 1)
+    dataSourceA = open_vector(ShpA)
     layerA = dataSourceA.GetLayer()
 
-    dataSourceB = driver.Open(ShpB, 1)
+    dataSourceB = open_vector(ShpB)
     layerB = dataSourceB.GetLayer()
 
+    # 交集的维度不超过两者中较低的一个，输出类型取维度较低的图层（相同时取B）
+    geom_types = []
+    for layer in (layerB, layerA):
+        geom_type = ogr.GT_Flatten(layer.GetGeomType())
+        geom_types.append(geom_type if geom_type != ogr.wkbUnknown else ogr.wkbPolygon)
+    geom_type = min(geom_types, key=lambda t: ogr.Geometry(t).GetDimension())
+    dimension = ogr.Geometry(geom_type).GetDimension()
+    if dimension > 0:
+        geom_type = _MULTI.get(geom_type, geom_type)  # 交集可能是多部件
+
     # 新建DataSource，Layer
-    out_ds = driver.CreateDataSource(fname)
-    out_lyr = out_ds.CreateLayer(fname, layerA.GetSpatialRef(), ogr.wkbPolygon)
-    def_feature = out_lyr.GetLayerDefn()
-    # 遍历原始的Shapefile文件给每个Geometry做Buffer操作
-    # current_union = layer[0].Clone()
-    print('the length of layer:', len(layerA))
-    if len(layerA) == 0:
+    writer = LayerWriter(fname, layerA.GetSpatialRef(), geom_type)
+    mapA = writer.copy_fields(layerA.GetLayerDefn()) if keep_fields else None
+    mapB = writer.copy_fields(layerB.GetLayerDefn()) if keep_fields else None
+    if len(layerA) == 0 or len(layerB) == 0:
+        writer.close()
+        del dataSourceA, dataSourceB
         return
 
-    for featureA in layerA:
-        geometryA = featureA.GetGeometryRef()
-        for featureB in layerB:
-            geometryB = featureB.GetGeometryRef()
-            inter = geometryB.Intersection(geometryA).Clone()
-            out_feature = ogr.Feature(def_feature)
-            out_feature.SetGeometry(inter)
-            out_lyr.ResetReading()
-            out_lyr.CreateFeature(out_feature)
-    del dataSourceA, dataSourceB, out_ds
+    # 较小的图层建立格网索引，较大的图层逐要素遍历
+    small_is_a = len(layerA) <= len(layerB)
+    small_layer, big_layer = (layerA, layerB) if small_is_a else (layerB, layerA)
+    small_features = []
+    envelopes = []
+    with timer('intersection', 'read', len(small_layer)):
+        for feature in small_layer:
+            geometry = feature.GetGeometryRef()
+            if geometry is None or geometry.IsEmpty():
+                continue
+            small_features.append(feature.Clone())
+            envelopes.append(geometry.GetEnvelope())
+        index = _GridIndex(envelopes)
+
+    # 读取、求交和写出交织在一个循环里，整体计为 compute
+    with timer('intersection', 'compute', len(big_layer)):
+        for big_feature in big_layer:
+            big_geometry = big_feature.GetGeometryRef()
+            if big_geometry is None or big_geometry.IsEmpty():
+                continue
+            for i in index.query(big_geometry.GetEnvelope()):
+                small_feature = small_features[i]
+                featureA, featureB = (small_feature, big_feature) if small_is_a else (big_feature, small_feature)
+                inter = featureB.GetGeometryRef().Intersection(featureA.GetGeometryRef())
+                inter = _keep_dimension(inter, dimension)
+                if inter is None:
+                    continue
+                writer.write(inter, sources=[(featureA, mapA), (featureB, mapB)] if keep_fields else ())
+    with timer('intersection', 'write', writer.count):
+        writer.close()
+    del dataSourceA, dataSourceB
+
+
+def dissolve(inShp, outShp, field=None, workers=None, batch_size=65536):
+    """
+        dissolve the features of a shapefile with a unary (cascaded) union
+    :param inShp: the path of input shapefile
+    :param outShp: the path of output shapefile
+    :param field: the name of field to group by, all features are merged into one if None
+    :param workers: the number of worker processes; Z-ordered partitions are unioned in parallel
+            and then merged, union in the current process if None
+    :param batch_size: the number of features read in one batch
+    :return:
+    """
+    VectorPipeline(inShp, workers=workers, batch_size=batch_size).dissolve(field).write(outShp)
 
 
 def MergeOneShp(inShp, outShp):
@@ -57,58 +192,23 @@ def MergeOneShp(inShp, outShp):
     :param outShp: the path of output shapefile
     :return:
     """
-    driver = ogr.GetDriverByName("ESRI Shapefile")
-    dataSource = driver.Open(inShp, 1)
-    layer = dataSource.GetLayer()
-
-    # 新建DataSource，Layer
-    out_ds = driver.CreateDataSource(outShp)
-    out_lyr = out_ds.CreateLayer(outShp, layer.GetSpatialRef(), ogr.wkbPolygon)
-    def_feature = out_lyr.GetLayerDefn()
-    # 遍历原始的Shapefile文件给每个Geometry做Buffer操作
-    # current_union = layer[0].Clone()
-    print('the length of layer:', len(layer))
-    if len(layer) == 0:
-        return
-
-    for i, feature in enumerate(layer):
-        geometry = feature.GetGeometryRef()
-        if i == 0:
-            current_union = geometry.Clone()
-        current_union = current_union.Union(geometry).Clone()
+    dissolve(inShp, outShp)
 
-        if i == len(layer) - 1:
-            out_feature = ogr.Feature(def_feature)
-            out_feature.SetGeometry(current_union)
-            out_lyr.ResetReading()
-            out_lyr.CreateFeature(out_feature)
 
-    del dataSource, out_ds
-
-
-def multipoly2singlepoly(inputshp, outputshp):
+def multipoly2singlepoly(inputshp, outputshp, keep_fields=True, parent_fid='parent_fid', workers=None,
+                         batch_size=65536):
     """
-        multi part to single part
+        multi part to single part, for multi points, lines, polygons and geometry collections
     :param inputshp: the path of input shapefile
     :param outputshp: the path of output shapefile
-    :return:
+    :param keep_fields: copy the attributes of the source feature into every part
+    :param parent_fid: the name of the field receiving the fid of the source feature, no such field if None
+    :param workers: the number of worker processes reading chunks of the input
+    :param batch_size: the number of features read at once
+    :return: the number of parts written
     """
-    gdal.UseExceptions()
-    driver = ogr.GetDriverByName('ESRI Shapefile')
-    in_ds = driver.Open(inputshp, 0)
-    in_lyr = in_ds.GetLayer()
-    if os.path.exists(outputshp):
-        driver.DeleteDataSource(outputshp)
-    out_ds = driver.CreateDataSource(outputshp)
-    out_lyr = out_ds.CreateLayer('poly', in_lyr.GetSpatialRef(), geom_type=ogr.wkbPolygon)
-    for in_feat in in_lyr:
-        geom = in_feat.GetGeometryRef()
-        if geom.GetGeometryName() == 'MULTIPOLYGON':
-            for geom_part in geom:
-                addPolygon(geom_part.ExportToWkb(), out_lyr)
-        else:
-            addPolygon(geom.ExportToWkb(), out_lyr)
-    del in_ds, out_ds
+    return VectorPipeline(inputshp, workers=workers, batch_size=batch_size).explode().write(
+        outputshp, keep_fields=keep_fields, layer_name='poly', parent_fid=parent_fid)
 
 
 def addPolygon(simplePolygon, out_lyr):
@@ -117,7 +217,52 @@ def addPolygon(simplePolygon, out_lyr):
     out_feat = ogr.Feature(featureDefn)
     out_feat.SetGeometry(polygon)
     out_lyr.CreateFeature(out_feat)
-    print('Polygon added.')
+
+
+def filter_by_area(inputShp, outputShp, min_area=None, max_area=None, where=None, method='sql'):
+    """
+        keep the features whose area is within [min_area, max_area]. The input is opened read-only
+        and the attributes are copied into the output.
+    :param inputShp: the path of input shapefile
+    :param outputShp: the path of output shapefile
+    :param min_area: the minimum area, no lower bound if None
+    :param max_area: the maximum area, no upper bound if None
+    :param where: an extra OGR SQL attribute filter, e.g. "cls = 'building'"
+    :param method: 'sql' evaluates the filter with the OGR SQL dialect (OGR_GEOM_AREA) and copies the layer in C,
+                falling back to 'array' if the driver cannot run it;
+                'array' computes the areas of all features as one numpy array with shapely
+    :return: the number of features written
+    """
+    if method == 'array':
+        return VectorPipeline(inputShp, where=where).filter_area(min_area, max_area).write(outputShp)
+    if method != 'sql':
+        raise ValueError("unknown method: %s" % method)
+
+    dataSource = open_vector(inputShp)
+    layer = dataSource.GetLayer()
+    clauses = ['(%s)' % where] if where else []
+    if min_area is not None:
+        clauses.append('OGR_GEOM_AREA >= %r' % float(min_area))
+    if max_area is not None:
+        clauses.append('OGR_GEOM_AREA <= %r' % float(max_area))
+    # OGR_GEOM_AREA 只存在于 OGR SQL 方言，GPKG/SQLite 的属性过滤会交给 SQLite，所以显式指定方言
+    sql = 'SELECT * FROM "%s"' % layer.GetName()
+    if clauses:
+        sql += ' WHERE ' + ' AND '.join(clauses)
+    try:
+        result = dataSource.ExecuteSQL(sql, dialect='OGRSQL')
+    except RuntimeError:
+        result = None
+    if result is None:
+        del dataSource
+        return filter_by_area(inputShp, outputShp, min_area, max_area, where, method='array')
+
+    out_ds = create_datasource(outputShp)
+    out_lyr = out_ds.CopyLayer(result, os.path.splitext(os.path.basename(outputShp))[0])
+    count = out_lyr.GetFeatureCount()
+    dataSource.ReleaseResultSet(result)
+    del dataSource, out_ds
+    return count
 
 
 def remove_big_feature(inputShp, outputShp, area_threshold):
@@ -128,33 +273,7 @@ def remove_big_feature(inputShp, outputShp, area_threshold):
     :param area_thresold: the threshold of area
     :return:
     """
-    driver = ogr.GetDriverByName("ESRI Shapefile")
-    dataSource = driver.Open(inputShp, 1)
-    layer = dataSource.GetLayer()
-    new_field = ogr.FieldDefn("Area", ogr.OFTReal)
-    new_field.SetWidth(32)
-    new_field.SetPrecision(16)  # 设置面积精度,小数点后16位
-    layer.CreateField(new_field)
-
-    # 新建DataSource，Layer
-    out_ds = driver.CreateDataSource(outputShp)
-    out_lyr = out_ds.CreateLayer(outputShp, layer.GetSpatialRef(), ogr.wkbPolygon)
-    def_feature = out_lyr.GetLayerDefn()
-
-    for feature in layer:
-        geom = feature.GetGeometryRef()
-        area = geom.GetArea()  # 计算面积
-        if area > area_threshold:
-            continue
-        feature.SetField("Area", area)  # 将面积添加到属性表中
-        layer.SetFeature(feature)
-        out_feature = ogr.Feature(def_feature)
-        out_feature.SetGeometry(geom)
-        out_lyr.CreateFeature(out_feature)
-        out_feature = None
-
-    out_ds.FlushCache()
-    del dataSource, out_ds
+    filter_by_area(inputShp, outputShp, max_area=area_threshold)
 
 
 def remove_small_feature(inputShp, outputShp, area_threshold):
@@ -165,242 +284,419 @@ def remove_small_feature(inputShp, outputShp, area_threshold):
     :param area_thresold: the threshold of area
     :return:
     """
-    driver = ogr.GetDriverByName("ESRI Shapefile")
-    dataSource = driver.Open(inputShp, 1)
-    layer = dataSource.GetLayer()
-    new_field = ogr.FieldDefn("Area", ogr.OFTReal)
-    new_field.SetWidth(32)
-    new_field.SetPrecision(16)  # 设置面积精度,小数点后16位
-    layer.CreateField(new_field)
-
-    # 新建DataSource，Layer
-    out_ds = driver.CreateDataSource(outputShp)
-    out_lyr = out_ds.CreateLayer(outputShp, layer.GetSpatialRef(), ogr.wkbPolygon)
-    def_feature = out_lyr.GetLayerDefn()
-
-    for feature in layer:
-        geom = feature.GetGeometryRef()
-        area = geom.GetArea()  # 计算面积
-        if area < area_threshold:
-            continue
-        feature.SetField("Area", area)  # 将面积添加到属性表中
-        layer.SetFeature(feature)
-        out_feature = ogr.Feature(def_feature)
-        out_feature.SetGeometry(geom)
-        out_lyr.CreateFeature(out_feature)
-        out_feature = None
-
-    out_ds.FlushCache()
-    del dataSource, out_ds
+    filter_by_area(inputShp, outputShp, min_area=area_threshold)
 
 
-def buffer(inShp, outShp, bdistance=0.02):
+def buffer(inShp, outShp, bdistance=0.02, workers=None, quad_segs=30, cap_style='round', join_style='round',
+           keep_fields=True):
     """
         setting up buffer zone in shapefile
     :param inShp: the path of input shapefile
     :param outShp: the path of output shapefile
     :param bdistance: the distance of buffer
+    :param workers: the number of worker processes, each buffers a range of FIDs; buffer in the
+            current process if None
+    :param quad_segs: the number of segments in a quarter circle
+    :param cap_style: round, flat or square
+    :param join_style: round, mitre or bevel
+    :param keep_fields: copy the attributes into the output
     :return:
     """
-    ogr.UseExceptions()
-    in_ds = ogr.Open(inShp)
-    in_lyr = in_ds.GetLayer()
-    # 创建输出Buffer文件
-    driver = ogr.GetDriverByName('ESRI Shapefile')
-    if Path(outShp).exists():
-        driver.DeleteDataSource(outShp)
-    # 新建DataSource，Layer
-    out_ds = driver.CreateDataSource(outShp)
-    out_lyr = out_ds.CreateLayer(outShp, in_lyr.GetSpatialRef(), ogr.wkbPolygon)
-    def_feature = out_lyr.GetLayerDefn()
-
-    # 遍历原始的Shapefile文件给每个Geometry做Buffer操作
-    for feature in in_lyr:
-        geometry = feature.GetGeometryRef()
-        buffer = geometry.Buffer(bdistance)
-        out_feature = ogr.Feature(def_feature)
-        out_feature.SetGeometry(buffer)
-        out_lyr.CreateFeature(out_feature)
-        out_feature = None
-    out_ds.FlushCache()
-    del in_ds, out_ds
+    VectorPipeline(inShp, workers=workers).buffer(bdistance, quad_segs, cap_style, join_style).write(
+        outShp, keep_fields=keep_fields)
 
 
-def smoothing(inShp, fname, bdistance=0.001):
+def smoothing(inShp, fname, bdistance=0.001, workers=None, quad_segs=30, join_style='round', keep_fields=True):
     """
     :param inShp: the path of input shapefile
     :param fname: the path of output shapefile
     :param bdistance: the distance of buffer
+    :param workers: the number of worker processes, smooth in the current process if None
+    :param quad_segs: the number of segments in a quarter circle
+    :param join_style: round, mitre or bevel
+    :param keep_fields: copy the attributes into the output
     :return:
     """
-    ogr.UseExceptions()
-    in_ds = ogr.Open(inShp)
-    in_lyr = in_ds.GetLayer()
-    # 创建输出Buffer文件
-    driver = ogr.GetDriverByName('ESRI Shapefile')
-    if Path(fname).exists():
-        driver.DeleteDataSource(fname)
-    # 新建DataSource，Layer
-    out_ds = driver.CreateDataSource(fname)
-    out_lyr = out_ds.CreateLayer(fname, in_lyr.GetSpatialRef(), ogr.wkbPolygon)
-    def_feature = out_lyr.GetLayerDefn()
-    # 遍历原始的Shapefile文件给每个Geometry做Buffer操作
-    for feature in in_lyr:
-        geometry = feature.GetGeometryRef()
-        buffer = geometry.Buffer(bdistance).Buffer(-bdistance)
-        out_feature = ogr.Feature(def_feature)
-        out_feature.SetGeometry(buffer)
-        out_lyr.CreateFeature(out_feature)
-        out_feature = None
-    out_ds.FlushCache()
-    del in_ds, out_ds
-
-
-def pol2line(polyfn, linefn):
-    """
-        This function is used to make polygon convert to line
-    :param polyfn: the path of input, the shapefile of polygon
-    :param linefn: the path of output, the shapefile of line
-    :return:
+    VectorPipeline(inShp, workers=workers).smooth(bdistance, quad_segs, join_style).write(
+        fname, keep_fields=keep_fields)
+
+
+def _zonal_values_stats(values, stats_list):
     """
-    driver = ogr.GetDriverByName('ESRI Shapefile')
-    polyds = ogr.Open(polyfn, 0)
-    polyLayer = polyds.GetLayer()
-    spatialref = polyLayer.GetSpatialRef()
-    #创建输出文件
-    if os.path.exists(linefn):
-        driver.DeleteDataSource(linefn)
-    lineds =driver.CreateDataSource(linefn)
-    linelayer = lineds.CreateLayer(linefn, srs=spatialref, geom_type=ogr.wkbLineString)
-    featuredefn = linelayer.GetLayerDefn()
-    #获取ring到几何体
-    #geomline = ogr.Geometry(ogr.wkbGeometryCollection)
-    for feat in polyLayer:
-        geom = feat.GetGeometryRef()
-        ring = geom.GetGeometryRef(0)
-        #geomcoll.AddGeometry(ring)
-        outfeature = ogr.Feature(featuredefn)
-        outfeature.SetGeometry(ring)
-        linelayer.CreateFeature(outfeature)
-        outfeature = None
+        the statistics of the pixel values under one polygon, None if there is no pixel
+    """
+    result = {}
+    if values.size == 0:
+        for stat in stats_list:
+            result[stat] = 0 if stat == 'count' else None
+        return result
+    if 'majority' in stats_list or 'minority' in stats_list or 'unique' in stats_list:
+        unique, counts = np.unique(values, return_counts=True)
+    for stat in stats_list:
+        if stat == 'count':
+            value = values.size
+        elif stat == 'min':
+            value = values.min()
+        elif stat == 'max':
+            value = values.max()
+        elif stat == 'mean':
+            value = values.mean()
+        elif stat == 'sum':
+            value = values.sum()
+        elif stat == 'std':
+            value = values.std()
+        elif stat == 'median':
+            value = np.median(values)
+        elif stat == 'range':
+            value = values.max() - values.min()
+        elif stat == 'majority':
+            value = unique[np.argmax(counts)]
+        elif stat == 'minority':
+            value = unique[np.argmin(counts)]
+        elif stat == 'unique':
+            value = unique.size
+        else:
+            raise ValueError("unknown statistic: %s" % stat)
+        result[stat] = value.item() if hasattr(value, 'item') else value
+    return result
 
 
-def ZonalStatisticsAsTable(ras_path, shp_path, stats_list=['majority']):
+def _pixel_window(envelope, geotrans, width, height):
     """
-        please refer to https://blog.csdn.net/weixin_42990464/article/details/114652193
+        the pixel window (xoff, yoff, xsize, ysize) covering an envelope, clipped to the raster
     """
-    start = time.time()
-    ras_driver = rasterio.open(ras_path)
-    array = ras_driver.read(1)
-    affine = ras_driver.transform
-    shp_driver = pd.read_file(shp_path)
-    zs = zonal_stats(shp_path, array, affine=affine, stats=stats_list)
+    x0 = int(np.floor((envelope[0] - geotrans[0]) / geotrans[1]))
+    x1 = int(np.ceil((envelope[1] - geotrans[0]) / geotrans[1]))
+    y0 = int(np.floor((envelope[3] - geotrans[3]) / geotrans[5]))
+    y1 = int(np.ceil((envelope[2] - geotrans[3]) / geotrans[5]))
+    x0, y0 = max(x0, 0), max(y0, 0)
+    x1, y1 = min(x1, width), min(y1, height)
+    return x0, y0, max(x1 - x0, 0), max(y1 - y0, 0)
+
 
-    driver = ogr.GetDriverByName('ESRI Shapefile')
-    layer_source = driver.Open(shp_path, 1)
+def _zonal_partition(args):
+    """
+        compute the statistics of a group of neighbouring polygons, reading the raster window under
+        the group once and rasterizing every polygon into a mask of its own sub-window
+    :return: list of (fid, stats)
+    """
+    ras_path, shp_path, fids, stats_list, band_index, all_touched = args
+    raster = open_raster(ras_path)
+    band = raster.GetRasterBand(band_index)
+    nodata = band.GetNoDataValue()
+    geotrans = raster.GetGeoTransform()
+    vector = open_vector(shp_path)
+    layer = vector.GetLayer()
+
+    features = [layer.GetFeature(fid) for fid in fids]
+    envelopes = [f.GetGeometryRef().GetEnvelope() if f.GetGeometryRef() is not None else None for f in features]
+    valid = [e for e in envelopes if e is not None]
+    results = []
+    if len(valid) == 0:
+        return [(fid, _zonal_values_stats(np.empty(0), stats_list)) for fid in fids]
+    group_env = (min(e[0] for e in valid), max(e[1] for e in valid), min(e[2] for e in valid), max(e[3] for e in valid))
+    gx, gy, gw, gh = _pixel_window(group_env, geotrans, raster.RasterXSize, raster.RasterYSize)
+    data = band.ReadAsArray(gx, gy, gw, gh) if gw > 0 and gh > 0 else None
+
+    mem_ds = ogr.GetDriverByName('Memory').CreateDataSource('')
+    mem_lyr = mem_ds.CreateLayer('zone', layer.GetSpatialRef(), ogr.wkbUnknown)
+    mem_defn = mem_lyr.GetLayerDefn()
+    mem_driver = gdal.GetDriverByName('MEM')
+    options = ['ALL_TOUCHED=TRUE'] if all_touched else []
+    for fid, feature, envelope in zip(fids, features, envelopes):
+        values = np.empty(0)
+        if data is not None and envelope is not None:
+            x, y, w, h = _pixel_window(envelope, geotrans, raster.RasterXSize, raster.RasterYSize)
+            if w > 0 and h > 0:
+                mask_ds = mem_driver.Create('', w, h, 1, gdal.GDT_Byte)
+                mask_ds.SetGeoTransform((geotrans[0] + x * geotrans[1], geotrans[1], geotrans[2],
+                                         geotrans[3] + y * geotrans[5], geotrans[4], geotrans[5]))
+                mem_feature = ogr.Feature(mem_defn)
+                mem_feature.SetGeometry(feature.GetGeometryRef())
+                mem_lyr.CreateFeature(mem_feature)
+                gdal.RasterizeLayer(mask_ds, [1], mem_lyr, burn_values=[1], options=options)
+                mem_lyr.DeleteFeature(mem_feature.GetFID())
+                mask = mask_ds.ReadAsArray().astype(bool)
+                window = data[y - gy:y - gy + h, x - gx:x - gx + w]
+                if nodata is not None:
+                    mask &= window != nodata
+                values = window[mask]
+        results.append((fid, _zonal_values_stats(values, stats_list)))
+    return results
+
+
+def zonal_statistics(ras_path, shp_path, stats_list=['majority'], band=1, workers=None, all_touched=False,
+                     tile_size=2048):
+    """
+        zonal statistics of a raster band under every polygon of a shapefile. Polygons are grouped into
+        spatial partitions of tile_size pixels, each partition reads only the raster window under it and
+        partitions can run in worker processes. The statistics are written back into the shapefile in
+        one transaction.
+    :param ras_path: the path of raster
+    :param shp_path: the path of shapefile, updated in place
+    :param stats_list: count, min, max, mean, sum, std, median, range, majority, minority, unique
+    :param band: the index of band
+    :param workers: the number of worker processes, run in the current process if None
+    :param all_touched: count every pixel touched by the polygon, not only the ones whose centre is inside
+    :param tile_size: the size of spatial partitions in pixels
+    :return: dict of fid -> dict of statistics
+    """
+    geotrans = raster_info(ras_path)['geotransform']
+    cell = (abs(geotrans[1]) * tile_size, abs(geotrans[5]) * tile_size)
+
+    layer_source = ogr.Open(shp_path, 1)
     lyr = layer_source.GetLayer()
+    partitions = {}
+    with timer('zonal_statistics', 'read', len(lyr)):
+        for feature in lyr:
+            geometry = feature.GetGeometryRef()
+            if geometry is None:
+                key = None
+            else:
+                env = geometry.GetEnvelope()
+                key = (int(((env[0] + env[1]) / 2. - geotrans[0]) // cell[0]),
+                       int(((env[2] + env[3]) / 2. - geotrans[3]) // cell[1]))
+            partitions.setdefault(key, []).append(feature.GetFID())
+    tasks = [(ras_path, shp_path, fids, stats_list, band, all_touched) for fids in partitions.values()]
+
+    zs = {}
+    with timer('zonal_statistics', 'compute') as t:
+        if workers is not None and workers > 1:
+            from multiprocessing import Pool
+            pool = Pool(workers)
+            chunks = pool.imap(_zonal_partition, tasks)
+        else:
+            pool = None
+            chunks = map(_zonal_partition, tasks)
+        try:
+            for done, chunk in enumerate(chunks):
+                zs.update(chunk)
+                progress('zonal_statistics', done + 1, len(tasks))
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+        t.add(len(zs))
+
     defn = lyr.GetLayerDefn()
+    for ele in stats_list:
+        if defn.GetFieldIndex(ele) < 0:
+            lyr.CreateField(ogr.FieldDefn(ele, ogr.OFTReal))
+
+    with timer('zonal_statistics', 'write', len(zs)):
+        lyr.StartTransaction()
+        for fid, stats in zs.items():
+            feature = lyr.GetFeature(fid)
+            for field_name, value in stats.items():
+                if value is None:
+                    feature.SetFieldNull(field_name)
+                else:
+                    feature.SetField(field_name, value)
+            lyr.SetFeature(feature)
+        lyr.CommitTransaction()
+    layer_source = None
+    invalidate(shp_path)  # 属性已更新，旧的只读句柄作废
+    return zs
 
-    featureCount = defn.GetFieldCount()
-    exists_fields = []
-    for i in range(featureCount):
-        field = defn.GetFieldDefn(i)
-        field_name = field.GetNameRef()
-        exists_fields.append(field_name)
 
-    for ele in stats_list:
-        if ele in exists_fields:
-            pass
+def ZonalStatisticsAsTable(ras_path, shp_path, stats_list=['majority']):
+    """
+        please refer to https://blog.csdn.net/weixin_42990464/article/details/114652193
+    """
+    zonal_statistics(ras_path, shp_path, stats_list)
+
+
+_GEOMETRY_METRICS = ('area', 'length', 'vertices')
+_STATISTICS_CACHE = OrderedDict()  # (path, stamp, metrics, bins, where) -> dict
+_STATISTICS_CAPACITY = 64
+_STATISTICS_LOCK = threading.Lock()
+
+
+def _geometry_metrics(wkbs, metrics):
+    """
+        the metrics of one batch of geometries, the missing geometries are dropped
+    """
+    import shapely
+
+    geoms = shapely.from_wkb(wkbs)
+    geoms = geoms[~shapely.is_missing(geoms)]
+    result = {}
+    for metric in metrics:
+        if metric == 'area':
+            result[metric] = shapely.area(geoms)
+        elif metric == 'length':
+            result[metric] = shapely.length(geoms)
         else:
-            # cls_name = ogr.FieldDefn(k, ogr.OFTString)
-            cls_name = ogr.FieldDefn(ele, ogr.OFTReal)
-            # cls_name.SetWidth(64)
-            lyr.CreateField(cls_name)
+            result[metric] = shapely.get_num_coordinates(geoms).astype(np.float64)
+    return result
 
-    driver = None
 
-    driver = ogr.GetDriverByName('ESRI Shapefile')
-    layer_source = driver.Open(shp_path, 1)
-    lyr = layer_source.GetLayer()
-    defn = lyr.GetLayerDefn()
+def _geometry_metrics_range(args):
+    """
+        worker: the metrics of the geometries of one chunk of _fid_ranges
+    """
+    path, chunk, where, metrics = args
+    _, wkbs, _ = _read_fid_range(path, chunk, where)
+    return _geometry_metrics(wkbs, metrics)
 
-    featureCount = defn.GetFieldCount()
-
-    count = 0
-    feature = lyr.GetNextFeature()
-    while feature is not None:
-        for i in range(featureCount):
-            field = defn.GetFieldDefn(i)
-            field_name = field.GetNameRef()
-            if field_name in stats_list:
-                feature.SetField(field_name, zs[count][field_name])
-                lyr.SetFeature(feature)
-            else:
-                pass
-        count += 1
-        feature = lyr.GetNextFeature()
 
-    end = time.time()
-    print((end - start) / 3600.0)
+def _statistics_key(path, metrics, bins, where):
+    stamp = _stamp(path)
+    if stamp is None:
+        return None
+    return os.path.abspath(path), stamp, tuple(metrics), bins, where
+
+
+def _cache_statistics(key, result):
+    with _STATISTICS_LOCK:
+        # 文件改写后旧版本的统计结果不再有用
+        for old in [old for old in _STATISTICS_CACHE if old[0] == key[0] and old[1] != key[1]]:
+            del _STATISTICS_CACHE[old]
+        _STATISTICS_CACHE[key] = result
+        _evict(_STATISTICS_CACHE, _STATISTICS_CAPACITY)
+
+
+def geometry_statistics(shpPath, metrics=_GEOMETRY_METRICS, bins=10, where=None, workers=None, batch_size=65536,
+                        cache=True):
+    """
+        statistics of the area, the length (perimeter for polygons) and the number of vertices of the
+        features, computed in one read-only pass
+    :param shpPath: the path of vector file
+    :param metrics: a subset of ('area', 'length', 'vertices')
+    :param bins: the number of histogram bins
+    :param where: an attribute filter
+    :param workers: the number of worker processes reading chunks of the input
+    :param batch_size: the number of features read at once
+    :param cache: reuse the result of an earlier call while the size and mtime of the file are unchanged,
+            the last 64 results are kept and a copy is returned
+    :return: dict of metric -> {'count', 'min', 'max', 'sum', 'mean', 'histogram': (counts, bin_edges)}
+    """
+    for metric in metrics:
+        if metric not in _GEOMETRY_METRICS:
+            raise ValueError("unknown metric: %s" % metric)
+    key = _statistics_key(shpPath, metrics, bins, where) if cache else None
+    if key is not None:
+        with _STATISTICS_LOCK:
+            cached = _STATISTICS_CACHE.get(key)
+            if cached is not None:
+                _STATISTICS_CACHE.move_to_end(key)
+        if cached is not None:
+            return copy.deepcopy(cached)
+
+    dataSource = open_vector(shpPath)
+    layer = dataSource.GetLayer()
+    if workers is not None and workers > 1:
+        from multiprocessing import Pool
+        tasks = [(shpPath, chunk, where, metrics) for chunk in _fid_ranges(layer, workers, where)]
+        with Pool(workers) as pool:
+            chunks = pool.map(_geometry_metrics_range, tasks)
+    else:
+        layer.SetAttributeFilter(where)
+        chunks = [_geometry_metrics(wkbs, metrics) for _, wkbs in _iter_wkb_batches(layer, batch_size, where)]
+    dataSource = None
+
+    result = {}
+    for metric in metrics:
+        values = np.concatenate([chunk[metric] for chunk in chunks]) if chunks else np.empty(0)
+        if values.size == 0:
+            result[metric] = {'count': 0, 'min': None, 'max': None, 'sum': 0., 'mean': None,
+                              'histogram': (np.zeros(bins, dtype=np.int64), None)}
+            continue
+        result[metric] = {'count': int(values.size), 'min': float(values.min()), 'max': float(values.max()),
+                          'sum': float(values.sum()), 'mean': float(values.mean()),
+                          'histogram': np.histogram(values, bins=bins)}
+    if key is not None:
+        _cache_statistics(key, copy.deepcopy(result))
+    return result
 
 
-def compute_max_area(shpPath):
+def compute_max_area(shpPath, workers=None):
     '''
-        compute max area among all features
+        compute max area among all features, the file is only read
     :param shpPath: the absolute path of shapefile
+    :param workers: the number of worker processes reading chunks of the input
     :return: the max area
     '''
-    max_area = 0
-    driver = ogr.GetDriverByName("ESRI Shapefile")
-    dataSource = driver.Open(shpPath, 1)
-    layer = dataSource.GetLayer()
-    new_field = ogr.FieldDefn("Area", ogr.OFTReal)
-    new_field.SetWidth(32)
-    new_field.SetPrecision(16)  # 设置面积精度,小数点后16位
-    layer.CreateField(new_field)
-    for feature in layer:
-        geom = feature.GetGeometryRef()
-        area = geom.GetArea()  # 计算面积
-        if area > max_area:
-            max_area = area
-        feature.SetField("Area", area)  # 将面积添加到属性表中
-        layer.SetFeature(feature)
-    dataSource = None
-    return max_area
+    max_area = geometry_statistics(shpPath, ('area',), workers=workers)['area']['max']
+    return max_area if max_area is not None else 0
 
 
-def extract_isolated_features(inShp, outshp, bdistance=0.008, temproot='./temp'):
+def extract_isolated_features(inShp, outshp, bdistance=0.008, temproot=None):
     """
-        extract isolated features among all features(point, line, polygon)
+        extract isolated features among all features(point, line, polygon).
+        The buffers are merged, the merged parts larger than the largest single buffer are removed and
+        the input is intersected with what is left. Every stage runs in memory on shapely arrays,
+        so concurrent calls do not share any file.
     :param inShp: the path of input shapefile
     :param outshp: the path of output shapefile
     :param bdistance: the distance of buffer
-    :param temproot: temporary file directory
+    :param temproot: unused, kept for compatibility; no temporary file is written
     :return: None
     """
-    mkdir(temproot)
-    fname = f'{temproot}/buffer.shp'
-    fname2 = f'{temproot}/buffer2.shp'
-    buffer(inShp, fname, bdistance=bdistance)
-    max_area = compute_max_area(fname)
-    MergeOneShp(fname, fname2)
-    multipoly2singlepoly(fname2, fname)
-    remove_big_feature(fname, fname2, max_area)
-    MergeOneShp(fname2, fname)
-    intersection(fname, inShp, outshp)
+    import shapely
+
+    in_ds = open_vector(inShp)
+    in_lyr = in_ds.GetLayer()
+    fids, wkbs = [], []
+    for batch_fids, batch_wkbs in _iter_wkb_batches(in_lyr):
+        fids.extend(batch_fids.tolist())
+        wkbs.extend(batch_wkbs)
+    geoms = shapely.from_wkb(wkbs)
+
+    geom_type = ogr.GT_Flatten(in_lyr.GetGeomType())
+    if geom_type == ogr.wkbUnknown:
+        geom_type = ogr.wkbPolygon
+    dimension = ogr.Geometry(geom_type).GetDimension()
+    if dimension > 0:
+        geom_type = _MULTI.get(geom_type, geom_type)  # 交集可能是多部件
+    writer = LayerWriter(outshp, in_lyr.GetSpatialRef(), geom_type)
+    field_map = writer.copy_fields(in_lyr.GetLayerDefn())
+    valid = ~shapely.is_missing(geoms)
+    if not valid.any():
+        writer.close()
+        del in_ds
+        return
 
-    # remove temporary directory
-    if os.path.exists(temproot):
-        shutil.rmtree(temproot)
+    # buffer -> 最大面积 -> 合并 -> 多部件转单部件 -> 去除大于最大面积的部件
+    buffers = shapely.buffer(geoms[valid], bdistance, quad_segs=30)
+    max_area = shapely.area(buffers).max()
+    parts = shapely.get_parts(shapely.union_all(buffers))
+    parts = parts[shapely.area(parts) <= max_area]
+
+    # 用空间索引求与原始要素的交集
+    tree = shapely.STRtree(parts)
+    feature_index, part_index = tree.query(geoms, predicate='intersects')
+    inters = shapely.intersection(geoms[feature_index], parts[part_index])
+
+    # 一个多部件要素可能与多个孤立部件相交，同一要素的交集合并后写出一次
+    groups = {}
+    for k, inter in zip(feature_index.tolist(), inters):
+        if not shapely.is_empty(inter):
+            groups.setdefault(k, []).append(inter)
+    for k in sorted(groups):
+        inter = groups[k][0] if len(groups[k]) == 1 else shapely.union_all(groups[k])
+        geometry = _keep_dimension(ogr.CreateGeometryFromWkb(shapely.to_wkb(inter)), dimension)
+        if geometry is None:
+            continue
+        writer.write(geometry, sources=[(in_lyr.GetFeature(fids[k]), field_map)])
+    writer.close()
+    del in_ds
 
 
-def simplify_shp(in_shp, out_shp, tolerance=0.0001):
+def simplify_shp(in_shp, out_shp, tolerance=0.0001, mode='simple', workers=None, batch_size=65536,
+                 preserve_topology=True, keep_fields=True):
     """
     :param in_shp: the path of input shapefile
     :param out_shp: the path of output shapefile
+    :param tolerance: the tolerance of Douglas-Peucker
+    :param mode: 'simple' simplifies every feature on its own, in chunks read by worker processes if workers > 1;
+            'topology' simplifies the edges shared by adjacent polygons once so no gaps or overlaps appear;
+            'coverage' uses shapely.coverage_simplify (shapely >= 2.1)
+    :param workers: the number of worker processes of the 'simple' mode
+    :param batch_size: the number of features read at once
+    :param preserve_topology: keep the simplified geometries valid in the 'simple' mode
+    :param keep_fields: copy the attributes into the output
     :return: Returns a simplified shapefile produced by the Douglas-Peucker
     """
-    gdf = pd.read_file(in_shp) #LINESTRING
-    gdf['geometry'] = simplify( gdf['geometry'], tolerance=tolerance)
-    gdf.to_file(out_shp, driver="ESRI Shapefile")
-
+    VectorPipeline(in_shp, workers=workers, batch_size=batch_size).simplify(
+        tolerance, preserve_topology, mode).write(out_shp, keep_fields=keep_fields)
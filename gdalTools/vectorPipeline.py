@@ -0,0 +1,674 @@
+"""
+    lazy, composable vector operations. The stages are only recorded until write() is called; they are
+    then fused and applied to batches of geometries (shapely arrays) in one pass over the source,
+    and the result is written once.
+
+        VectorPipeline('roads.shp').buffer(5).dissolve().explode().write('blocks.shp')
+"""
+from functools import partial
+import itertools
+import numpy as np
+from osgeo import ogr
+from .datasetCache import open_vector
+from .instrumentation import progress, timer
+from .layerWriter import _MULTI, LayerWriter
+
+
+def _filter_fields(defn, where):
+    """
+        the names of the fields an attribute filter refers to, which must not be ignored: the OGR SQL
+        evaluator would see them as null
+    """
+    if not where:
+        return set()
+    import re
+
+    # 去掉字符串常量后，双引号内或裸露的标识符都可能是字段名
+    tokens = re.findall(r'"((?:[^"]|"")+)"|([A-Za-z_]\w*)', re.sub(r"'(?:[^']|'')*'", "''", where))
+    names = {(quoted.replace('""', '"') or bare).lower() for quoted, bare in tokens}
+    return {defn.GetFieldDefn(i).GetNameRef() for i in range(defn.GetFieldCount())
+            if defn.GetFieldDefn(i).GetNameRef().lower() in names}
+
+
+def _ignored_fields(defn, where=None, fields=()):
+    """
+        the fields not to read: all but those of the attribute filter and the fields asked for
+    """
+    kept = _filter_fields(defn, where) | set(fields)
+    names = [defn.GetFieldDefn(i).GetNameRef() for i in range(defn.GetFieldCount())]
+    return [name for name in names if name not in kept]
+
+
+def _iter_wkb_batches(layer, batch_size=65536, where=None):
+    """
+        read the geometries of a layer in batches, through the Arrow stream when GDAL >= 3.6 provides it
+    :param where: the attribute filter set on the layer, its fields are still read
+    :return: yields (fids, wkbs), numpy array of FIDs and sequence of WKB
+    """
+    if hasattr(layer, 'GetArrowStreamAsNumPy'):
+        layer.SetIgnoredFields(_ignored_fields(layer.GetLayerDefn(), where))
+        fid_column = layer.GetFIDColumn() or 'OGC_FID'
+        geom_column = layer.GetGeometryColumn() or 'wkb_geometry'
+        try:
+            stream = layer.GetArrowStreamAsNumPy(options=['MAX_FEATURES_IN_BATCH=%d' % batch_size])
+            for batch in stream:
+                yield np.asarray(batch[fid_column]), batch[geom_column]
+        finally:
+            layer.SetIgnoredFields([])
+        return
+    fids, wkbs = [], []
+    layer.ResetReading()
+    for feature in layer:
+        geometry = feature.GetGeometryRef()
+        fids.append(feature.GetFID())
+        wkbs.append(geometry.ExportToWkb() if geometry is not None else None)
+        if len(fids) == batch_size:
+            yield np.asarray(fids), wkbs
+            fids, wkbs = [], []
+    if fids:
+        yield np.asarray(fids), wkbs
+
+
+def _fid_ranges(layer, workers, where=None, min_chunk=1024):
+    """
+        split a layer into chunks holding about the same number of features, a few per worker. Only the
+        SQL based drivers (GPKG) index their FID column, so they get ('range', start, stop) FID ranges;
+        the other drivers get ('slice', start, stop) positions read with SetNextByIndex, or with an
+        attribute filter ('fids', array) lists of the matching FIDs read with GetFeature.
+    """
+    if layer.GetFIDColumn():
+        kind = 'range'
+    else:
+        kind = 'slice' if not where else 'fids'
+    if kind == 'slice':
+        count = layer.GetFeatureCount()
+        step = max(min_chunk, -(-count // (max(workers or 1, 1) * 4)))
+        return [('slice', i, min(i + step, count)) for i in range(0, count, step)]
+
+    defn = layer.GetLayerDefn()
+    # 属性过滤用到的字段不能忽略，所以有过滤时只忽略几何
+    ignored = [defn.GetFieldDefn(i).GetNameRef() for i in range(defn.GetFieldCount())] if not where else []
+    layer.SetIgnoredFields(ignored + ['OGR_GEOMETRY'])
+    layer.SetAttributeFilter(where)
+    layer.ResetReading()
+    try:
+        fids = np.sort(np.fromiter((feature.GetFID() for feature in layer), dtype=np.int64))
+    finally:
+        layer.SetIgnoredFields([])
+        layer.SetAttributeFilter(None)
+        layer.ResetReading()
+    step = max(min_chunk, -(-len(fids) // (max(workers or 1, 1) * 4)))
+    if kind == 'fids':
+        return [('fids', fids[i:i + step]) for i in range(0, len(fids), step)]
+    return [('range', int(fids[i]), int(fids[min(i + step, len(fids)) - 1]) + 1) for i in range(0, len(fids), step)]
+
+
+def _fid_clause(layer, start, stop):
+    """
+        the attribute filter start <= FID < stop on the FID column of SQL based drivers (GPKG)
+    """
+    column = '"%s"' % layer.GetFIDColumn()
+    return '%s >= %d AND %s < %d' % (column, start, column, stop)
+
+
+def _read_features(layer, features, fields=()):
+    """
+        the FIDs, WKB and attributes of fields of a sequence of features
+    :return: (fids, wkbs, values), values is a list of {field: value}, None without fields
+    """
+    defn = layer.GetLayerDefn()
+    indexes = [defn.GetFieldIndex(name) for name in fields]
+    fids, wkbs = [], []
+    values = [] if fields else None
+    for feature in features:
+        geometry = feature.GetGeometryRef()
+        fids.append(feature.GetFID())
+        wkbs.append(geometry.ExportToWkb() if geometry is not None else None)
+        if values is not None:
+            values.append({name: feature.GetField(i) for name, i in zip(fields, indexes)})
+    return np.asarray(fids, dtype=np.int64), wkbs, values
+
+
+def _iter_batches(layer, batch_size=65536, where=None, fields=()):
+    """
+        read the geometries of a layer in batches together with the attributes of fields, so the
+        attributes do not need a second read of the features
+    :param where: the attribute filter set on the layer
+    :return: yields (fids, wkbs, values), values is a list of {field: value}, None without fields
+    """
+    if not fields:
+        for fids, wkbs in _iter_wkb_batches(layer, batch_size, where):
+            yield fids, wkbs, None
+        return
+    layer.SetIgnoredFields(_ignored_fields(layer.GetLayerDefn(), where, fields))
+    layer.ResetReading()
+    features = iter(layer.GetNextFeature, None)
+    try:
+        while True:
+            fids, wkbs, values = _read_features(layer, itertools.islice(features, batch_size), fields)
+            if len(fids) == 0:
+                return
+            yield fids, wkbs, values
+    finally:
+        layer.SetIgnoredFields([])
+
+
+def _read_fid_range(path, chunk, where=None, fields=()):
+    """
+        read the geometries, and the attributes of fields, of one chunk of _fid_ranges
+    :return: (fids, wkbs, values), values is None without fields
+    """
+    ds = open_vector(path)
+    layer = ds.GetLayer()
+    kind = chunk[0]
+    if kind == 'range':
+        clause = _fid_clause(layer, chunk[1], chunk[2])
+        clause = clause if where is None else '%s AND (%s)' % (clause, where)
+        layer.SetAttributeFilter(clause)
+        fids, wkbs = [], []
+        values = [] if fields else None
+        for batch_fids, batch_wkbs, batch_values in _iter_batches(layer, where=clause, fields=fields):
+            fids.extend(batch_fids.tolist())
+            wkbs.extend(batch_wkbs)
+            if values is not None:
+                values.extend(batch_values)
+        del ds
+        return np.asarray(fids, dtype=np.int64), wkbs, values
+
+    layer.SetIgnoredFields(_ignored_fields(layer.GetLayerDefn(), fields=fields))
+    try:
+        if kind == 'slice':
+            # 没有属性过滤时 SetNextByIndex 直接定位（Shapefile 按 .shx 跳转），不必扫描整个文件
+            start, stop = chunk[1], chunk[2]
+            layer.SetNextByIndex(start)
+            features = (layer.GetNextFeature() for _ in range(stop - start))
+            result = _read_features(layer, (feature for feature in features if feature is not None), fields)
+        else:
+            result = _read_features(layer, (layer.GetFeature(int(fid)) for fid in chunk[1]), fields)
+    finally:
+        layer.SetIgnoredFields([])
+        layer.ResetReading()
+    del ds
+    return result
+
+
+def _single_type(geom_type):
+    # 集合类型拆开后可能是任意单部件类型
+    return {ogr.wkbMultiPolygon: ogr.wkbPolygon, ogr.wkbMultiLineString: ogr.wkbLineString,
+            ogr.wkbMultiPoint: ogr.wkbPoint, ogr.wkbGeometryCollection: ogr.wkbUnknown}.get(geom_type, geom_type)
+
+
+def _morton_order(geoms):
+    """
+        the order of geometries along a Z-order curve of their bounding box centres
+    """
+    import shapely
+
+    bounds = np.nan_to_num(shapely.bounds(geoms))
+    cx = (bounds[:, 0] + bounds[:, 2]) / 2.
+    cy = (bounds[:, 1] + bounds[:, 3]) / 2.
+
+    def spread(v):
+        v = ((v - v.min()) / max(np.ptp(v), 1e-12) * 65535).astype(np.int64)
+        v = (v | (v << 8)) & 0x00FF00FF
+        v = (v | (v << 4)) & 0x0F0F0F0F
+        v = (v | (v << 2)) & 0x33333333
+        return (v | (v << 1)) & 0x55555555
+
+    return np.argsort(spread(cx) | (spread(cy) << 1), kind='stable')
+
+
+# 每个 stage 接收一个 shapely 数组，返回 (新数组, 输出行对应的输入行)，后者为 None 表示一一对应
+def _stage_buffer(geoms, distances, quad_segs, cap_style, join_style):
+    import shapely
+
+    for distance in distances:
+        geoms = shapely.buffer(geoms, distance, quad_segs=quad_segs, cap_style=cap_style, join_style=join_style)
+    return geoms, None
+
+
+def _stage_simplify(geoms, tolerance, preserve_topology):
+    import shapely
+
+    return shapely.simplify(geoms, tolerance, preserve_topology=preserve_topology), None
+
+
+def _stage_filter_area(geoms, min_area, max_area):
+    import shapely
+
+    areas = shapely.area(geoms)
+    mask = ~np.isnan(areas)
+    if min_area is not None:
+        mask &= areas >= min_area
+    if max_area is not None:
+        mask &= areas <= max_area
+    index = np.nonzero(mask)[0]
+    return geoms[index], index
+
+
+def _stage_explode(geoms):
+    import shapely
+
+    parts, index = shapely.get_parts(geoms, return_index=True)
+    # 集合中可能嵌套多部件几何，拆到只剩单部件为止
+    nested = np.nonzero(shapely.get_type_id(parts) >= 4)[0]
+    while len(nested):
+        sub_parts, sub_index = shapely.get_parts(parts[nested], return_index=True)
+        keep = np.ones(len(parts), dtype=bool)
+        keep[nested] = False
+        order = np.argsort(np.concatenate([np.nonzero(keep)[0], nested[sub_index]]), kind='stable')
+        parts = np.concatenate([parts[keep], sub_parts])[order]
+        index = np.concatenate([index[keep], index[nested][sub_index]])[order]
+        nested = np.nonzero(shapely.get_type_id(parts) >= 4)[0]
+    return parts, index
+
+
+def _stage_polygon_to_line(geoms, interiors):
+    import shapely
+
+    parts, part_index = shapely.get_parts(geoms, return_index=True)
+    if not interiors:
+        return shapely.get_exterior_ring(parts), part_index
+    # LinearRing 写成 WKB 时即为 LineString
+    rings, ring_index = shapely.get_rings(parts, return_index=True)
+    return rings, part_index[ring_index]
+
+
+def _stage_merge_lines(geoms):
+    import shapely
+
+    return shapely.line_merge(geoms), None
+
+
+def _ring_lines(lines):
+    """
+        the lines with their repeated points removed and the mask of those that can form a ring, i.e.
+        have 3 distinct points (4 coordinates once closed)
+    """
+    import shapely
+
+    lines = shapely.remove_repeated_points(lines)
+    closed = shapely.is_closed(lines)
+    return lines, shapely.get_num_coordinates(lines) - closed >= 3
+
+
+def _stage_line_to_polygon(geoms):
+    """
+        single lines become polygons straight from their coordinate arrays (rings are closed
+        automatically), multipart lines are polygonized. Lines that cannot form a ring are dropped.
+    """
+    import shapely
+
+    out = np.full(len(geoms), None, dtype=object)
+    type_ids = shapely.get_type_id(geoms)
+    single = np.nonzero((type_ids == 1) | (type_ids == 2))[0]
+    lines, ring = _ring_lines(geoms[single])
+    single, lines = single[ring], lines[ring]
+    if len(single):
+        coords, index = shapely.get_coordinates(lines, return_index=True)
+        # linearrings 会自动闭合未闭合的环
+        out[single] = shapely.polygons(shapely.linearrings(coords, indices=index))
+
+    for k in np.nonzero(type_ids == 5)[0]:
+        parts = shapely.get_parts(geoms[k])
+        polygons = shapely.get_parts(shapely.polygonize(parts))
+        if len(polygons) == 0:
+            # 各部件未相互闭合时逐个闭合成环
+            parts, ring = _ring_lines(parts)
+            parts = parts[ring]
+            if len(parts) == 0:
+                continue
+            coords, index = shapely.get_coordinates(parts, return_index=True)
+            polygons = shapely.polygons(shapely.linearrings(coords, indices=index))
+        out[k] = polygons[0] if len(polygons) == 1 else shapely.multipolygons(polygons)
+    index = np.nonzero(~shapely.is_missing(out))[0]
+    return out[index], index
+
+
+def _apply(stages, geoms, fids, values=None):
+    """
+        run fused map stages over one batch, keeping fids and values aligned with the geometries
+    """
+    for stage in stages:
+        geoms, index = stage(geoms)
+        if index is not None:
+            fids = fids[index]
+            if values is not None:
+                values = [values[i] for i in index]
+    return geoms, fids, values
+
+
+def _run_range(args):
+    """
+        worker: read one chunk of FIDs and run the fused map stages over it
+    """
+    import shapely
+
+    path, chunk, where, fields, stages = args
+    fids, wkbs, values = _read_fid_range(path, chunk, where, fields)
+    geoms, fids, values = _apply(stages, shapely.from_wkb(wkbs), fids, values)
+    return fids, shapely.to_wkb(geoms), values
+
+
+def _union_wkb(wkbs):
+    """
+        worker of the parallel dissolve: union a partition given as WKB and return WKB
+    """
+    import shapely
+
+    return shapely.to_wkb(shapely.union_all(shapely.from_wkb(wkbs)))
+
+
+def _union(geoms, workers, pool=None):
+    """
+        unary (cascaded) union, optionally of Z-ordered partitions in worker processes then merged
+    :param pool: the multiprocessing pool to run the partitions in, one of workers processes is made if None
+    """
+    import shapely
+
+    if workers is None or workers <= 1 or len(geoms) < 4 * workers:
+        return shapely.union_all(geoms)
+    ordered = geoms[_morton_order(geoms)]
+    partitions = [shapely.to_wkb(part) for part in np.array_split(ordered, workers)]
+    if pool is None:
+        from multiprocessing import Pool
+        with Pool(workers) as pool:
+            partial_unions = pool.map(_union_wkb, partitions)
+    else:
+        partial_unions = pool.map(_union_wkb, partitions)
+    return shapely.union_all(shapely.from_wkb(partial_unions))
+
+
+# barrier 需要之前的全部要素，接收并返回 (geoms, fids, values)；values 为每个要素的 {字段: 值}
+def _barrier_dissolve(geoms, fids, values, workers, field):
+    if field:
+        keys = [row.get(field) for row in values]
+    else:
+        keys = [None] * len(geoms)
+    groups = {}
+    for i, key in enumerate(keys):
+        groups.setdefault(key, []).append(i)
+    import shapely
+
+    unions = np.empty(len(groups), dtype=object)
+    pool = None
+    if workers is not None and workers > 1 and any(len(rows) >= 4 * workers for rows in groups.values()):
+        # 所有分组共用一个进程池，避免每个分组都创建进程
+        from multiprocessing import Pool
+        pool = Pool(workers)
+    try:
+        unions[:] = [_union(geoms[rows], workers, pool) for rows in groups.values()]
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    # 没有几何的分组合并结果为空，不写出
+    keep = np.nonzero(~shapely.is_missing(unions) & ~shapely.is_empty(unions))[0]
+    keys = list(groups)
+    return unions[keep], np.full(len(keep), -1, dtype=np.int64), [{field: keys[i]} if field else {} for i in keep]
+
+
+def _barrier_coverage_simplify(geoms, fids, values, workers, tolerance):
+    """
+        simplify a polygon coverage with shapely.coverage_simplify (shapely >= 2.1, GEOS >= 3.12)
+    """
+    import shapely
+
+    if not hasattr(shapely, 'coverage_simplify'):
+        raise ImportError("coverage simplification needs shapely >= 2.1 built with GEOS >= 3.12")
+    return shapely.coverage_simplify(geoms, tolerance), fids, values
+
+
+def _barrier_topology_simplify(geoms, fids, values, workers, tolerance):
+    """
+        simplify the shared edges once so that adjacent polygons stay consistent: the rings are noded
+        into unique edges, every edge is simplified with its end nodes fixed, the edges are polygonized
+        and every face is given back to the polygon it overlaps most. A polygon left without a face keeps
+        its own simplified geometry.
+    """
+    import shapely
+
+    valid = np.nonzero(~shapely.is_missing(geoms) & ~shapely.is_empty(geoms))[0]
+    out = np.full(len(geoms), None, dtype=object)
+    if len(valid) == 0:
+        return out, fids, values
+    polygons = geoms[valid]
+    edges = shapely.get_parts(shapely.line_merge(shapely.union_all(shapely.boundary(polygons))))
+    edges = shapely.simplify(edges, tolerance, preserve_topology=True)
+    faces = shapely.get_parts(shapely.polygonize(edges))
+    face_index, owner = shapely.STRtree(polygons).query(faces, predicate='intersects')
+    overlap = shapely.area(shapely.intersection(faces[face_index], polygons[owner]))
+    # 每个面取重叠面积最大的多边形，重叠不足一半的面（多边形之间的空隙）丢弃
+    order = np.lexsort((-overlap, face_index))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = face_index[order][1:] != face_index[order][:-1]
+    best = order[first]
+    best = best[overlap[best] >= 0.5 * shapely.area(faces[face_index[best]])]
+    groups = {}
+    for f, o in zip(face_index[best].tolist(), owner[best].tolist()):
+        groups.setdefault(o, []).append(f)
+    for o, face_rows in groups.items():
+        out[valid[o]] = shapely.union_all(faces[face_rows])
+    missing = np.setdiff1d(np.arange(len(valid)), np.fromiter(groups, dtype=np.int64, count=len(groups)))
+    if len(missing):
+        out[valid[missing]] = shapely.simplify(polygons[missing], tolerance, preserve_topology=True)
+    return out, fids, values
+
+
+class VectorPipeline(object):
+    """
+        a lazy chain of vector operations over one OGR datasource
+    :param source: the path of input vector file
+    :param workers: the number of worker processes, run in the current process if None
+    :param batch_size: the number of features in one batch
+    :param where: an OGR SQL attribute filter applied to the source
+    """
+    def __init__(self, source, workers=None, batch_size=65536, where=None):
+        self.source = source
+        self.workers = workers
+        self.batch_size = batch_size
+        self.where = where
+        self._stages = []  # (map stage, barrier, geom_type, 保留的字段或 None)
+
+    def _add(self, stage, geom_type=None):
+        self._stages.append((stage, None, geom_type, None))
+        return self
+
+    def _add_barrier(self, barrier, fields=None):
+        self._stages.append((None, barrier, None, fields))
+        return self
+
+    def buffer(self, distance, quad_segs=30, cap_style='round', join_style='round'):
+        return self._add(partial(_stage_buffer, distances=(distance,), quad_segs=quad_segs,
+                                 cap_style=cap_style, join_style=join_style), ogr.wkbPolygon)
+
+    def smooth(self, distance, quad_segs=30, join_style='round'):
+        """
+            buffer out then back in by distance
+        """
+        return self._add(partial(_stage_buffer, distances=(distance, -distance), quad_segs=quad_segs,
+                                 cap_style='round', join_style=join_style), ogr.wkbPolygon)
+
+    def simplify(self, tolerance, preserve_topology=True, mode='simple'):
+        """
+        :param mode: 'simple' simplifies every geometry on its own, batch by batch;
+                'topology' simplifies the edges shared by adjacent polygons once, so they stay consistent;
+                'coverage' uses shapely.coverage_simplify. The last two need every feature before them.
+        """
+        if mode == 'simple':
+            return self._add(partial(_stage_simplify, tolerance=tolerance, preserve_topology=preserve_topology))
+        if mode == 'topology':
+            return self._add_barrier(partial(_barrier_topology_simplify, tolerance=tolerance))
+        if mode == 'coverage':
+            return self._add_barrier(partial(_barrier_coverage_simplify, tolerance=tolerance))
+        raise ValueError("unknown simplify mode: %s" % mode)
+
+    def filter_area(self, min_area=None, max_area=None):
+        return self._add(partial(_stage_filter_area, min_area=min_area, max_area=max_area))
+
+    def explode(self):
+        """
+            split multi-part geometries and collections (nested ones included) into single parts;
+            every part keeps the fid and the attributes of its source feature
+        """
+        return self._add(_stage_explode, 'single')
+
+    def polygon_to_line(self, interiors=True):
+        """
+            the rings of every polygon part as lines, the interior rings too if interiors
+        """
+        return self._add(partial(_stage_polygon_to_line, interiors=interiors), ogr.wkbLineString)
+
+    def merge_lines(self):
+        """
+            sew connected lines together (line merge)
+        """
+        return self._add(_stage_merge_lines)
+
+    def line_to_polygon(self):
+        return self._add(_stage_line_to_polygon, ogr.wkbPolygon)
+
+    def dissolve(self, field=None):
+        """
+            merge all geometries, or the ones sharing a value of field, into one feature.
+            This stage needs every batch before it, the stages after it run on its result.
+        """
+        return self._add_barrier(partial(_barrier_dissolve, field=field), (field,) if field else ())
+
+    def _output_type(self, source_type):
+        """
+            the layer type of the output. Polygons and lines are declared multi unless the last stage that
+            can merge parts is followed by explode() or polygon_to_line(); points only become multi
+            after a dissolve
+        """
+        geom_type = ogr.GT_Flatten(source_type)
+        single, dissolved = False, False
+        for stage, barrier, stage_type, _ in self._stages:
+            if stage_type == 'single':
+                geom_type = _single_type(geom_type)
+                single, dissolved = True, False
+            elif stage_type is not None:
+                geom_type = stage_type
+                single = stage_type == ogr.wkbLineString
+            elif barrier is not None:
+                single = False
+                dissolved = dissolved or barrier.func is _barrier_dissolve
+            elif not (isinstance(stage, partial) and stage.func is _stage_filter_area):
+                single = False  # 过滤不会合并部件
+        if single or (geom_type == ogr.wkbPoint and not dissolved):
+            return geom_type
+        return _MULTI.get(geom_type, geom_type)
+
+    def _segments(self):
+        """
+            split the stages at the barriers: [(map stages, barrier or None), ...]
+        """
+        segments, current = [], []
+        for stage, barrier, _, _ in self._stages:
+            if barrier is not None:
+                segments.append((current, barrier))
+                current = []
+            else:
+                current.append(stage)
+        segments.append((current, None))
+        return segments
+
+    def _iter_first_segment(self, read_layer, stages, fields):
+        """
+            yield (fids, geoms, values) batches of the source after the first fused segment
+        """
+        import shapely
+
+        if self.workers is not None and self.workers > 1:
+            from multiprocessing import Pool
+            tasks = [(self.source, chunk, self.where, fields, stages)
+                     for chunk in _fid_ranges(read_layer, self.workers, self.where)]
+            with Pool(self.workers) as pool:
+                results = pool.imap(_run_range, tasks)
+                while True:
+                    # 读取和计算都在子进程中完成，这里只能统计等待结果的时间
+                    with timer('VectorPipeline', 'compute') as t:
+                        result = next(results, None)
+                        if result is not None:
+                            t.add(len(result[0]))
+                    if result is None:
+                        return
+                    yield result[0], shapely.from_wkb(result[1]), result[2]
+        read_layer.SetAttributeFilter(self.where)
+        reader = _iter_batches(read_layer, self.batch_size, self.where, fields)
+        while True:
+            with timer('VectorPipeline', 'read') as t:
+                batch = next(reader, None)
+                if batch is not None:
+                    t.add(len(batch[0]))
+            if batch is None:
+                return
+            with timer('VectorPipeline', 'compute', len(batch[0])):
+                geoms, fids, values = _apply(stages, shapely.from_wkb(batch[1]), batch[0], batch[2])
+            yield fids, geoms, values
+
+    def write(self, path, keep_fields=True, layer_name=None, driver=None, batch_size=10000, parent_fid=None):
+        """
+            run the pipeline and write the result
+        :param path: the path of output, the format follows the extension (.shp, .gpkg, .fgb, .parquet)
+        :param keep_fields: copy the attributes of the source features into the output
+        :param layer_name: the name of output layer, the file name if None
+        :param driver: the name of OGR driver, chosen from the extension if None
+        :param batch_size: the number of features in one write transaction
+        :param parent_fid: the name of a field receiving the fid of the source feature, -1 after a dissolve
+        :return: the number of features written
+        """
+        import shapely
+
+        with timer('VectorPipeline', 'open'):
+            read_ds = open_vector(self.source)
+            read_layer = read_ds.GetLayer()
+            in_defn = read_layer.GetLayerDefn()
+            writer = LayerWriter(path, read_layer.GetSpatialRef(), self._output_type(read_layer.GetGeomType()),
+                                 driver=driver, layer_name=layer_name, batch_size=batch_size)
+        segments = self._segments()
+        kept_fields = [fields for _, _, _, fields in self._stages if fields is not None]
+        # 属性与几何在同一次读取中得到：融合时读取分组字段，否则读取全部字段
+        read_fields = []
+        out_index = {}
+        if parent_fid:
+            writer.add_field(ogr.FieldDefn(parent_fid, ogr.OFTInteger64))
+        if kept_fields:
+            read_fields = list(dict.fromkeys(field for fields in kept_fields for field in fields))
+            # 融合之后只保留最后一次融合所用的字段
+            for field in kept_fields[-1]:
+                writer.add_field(in_defn.GetFieldDefn(in_defn.GetFieldIndex(field)))
+        elif keep_fields:
+            read_fields = [in_defn.GetFieldDefn(i).GetNameRef() for i in range(in_defn.GetFieldCount())]
+            out_index = dict(zip(read_fields, writer.copy_fields(in_defn)))
+
+        def write_batch(geoms, fids, values):
+            with timer('VectorPipeline', 'write', len(geoms)):
+                for i, (fid, wkb) in enumerate(zip(fids.tolist(), shapely.to_wkb(geoms))):
+                    # 复制的字段可能被改名，按输出字段的序号写入
+                    extra = {out_index.get(k, k): v for k, v in values[i].items()} if values is not None else {}
+                    if parent_fid:
+                        extra[parent_fid] = fid
+                    writer.write(wkb, values=extra)
+            progress('VectorPipeline', writer.count)
+
+        batches = self._iter_first_segment(read_layer, segments[0][0], read_fields)
+        if segments[0][1] is None:
+            for fids, geoms, values in batches:
+                write_batch(geoms, fids, values)
+        else:
+            collected = list(batches)
+            geoms = np.concatenate([g for _, g, _ in collected]) if collected else np.empty(0, dtype=object)
+            fids = np.concatenate([f for f, _, _ in collected]) if collected else np.empty(0, dtype=np.int64)
+            values = [row for _, _, v in collected for row in v] if read_fields else None
+            with timer('VectorPipeline', 'compute', len(geoms)):
+                for k, (stages, barrier) in enumerate(segments):
+                    if k > 0:
+                        geoms, fids, values = _apply(stages, geoms, fids, values)
+                    if barrier is not None:
+                        geoms, fids, values = barrier(geoms, fids, values, self.workers)
+            write_batch(geoms, fids, values)
+        with timer('VectorPipeline', 'write'):
+            writer.close()
+        del read_ds
+        return writer.count
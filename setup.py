@@ -14,9 +14,8 @@ setuptools.setup(
     url="https://github.com/SonwYang/gdaltools.git",
     packages=setuptools.find_packages(),
     install_requires=['gdal>=3.0.1',
-                      'geopandas>=0.8.2',
-                      'rasterio>=1.2.0',
-                      'rasterstats>=0.15.0'],
+                      'numpy',
+                      'shapely>=2.0'],
     classifiers=(
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
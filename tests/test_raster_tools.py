@@ -0,0 +1,123 @@
+"""
+    the sliding-window stitching, the stretch histogram and the tiled writer on small synthetic rasters
+"""
+import random
+
+import pytest
+
+np = pytest.importorskip('numpy')
+gdal = pytest.importorskip('osgeo.gdal')
+gdal_array = pytest.importorskip('osgeo.gdal_array')
+
+import gdalTools
+from gdalTools.rasterTools import _band_histogram, _histogram_percentiles
+
+
+def _make_raster(path, data, nodata=None):
+    data = data if data.ndim == 3 else data[np.newaxis]
+    datatype = gdal_array.NumericTypeCodeToGDALTypeCode(data.dtype)
+    ds = gdal.GetDriverByName('GTiff').Create(str(path), data.shape[2], data.shape[1], data.shape[0], datatype)
+    ds.SetGeoTransform((0., 1., 0., float(data.shape[1]), 0., -1.))
+    for i in range(data.shape[0]):
+        band = ds.GetRasterBand(i + 1)
+        if nodata is not None:
+            band.SetNoDataValue(nodata)
+        band.WriteArray(data[i])
+    ds = None
+    return str(path)
+
+
+def test_sliding_windows_cover_the_image():
+    windows = gdalTools.sliding_windows(300, 200, tile_size=128, overlap=32)
+    covered = np.zeros((200, 300), dtype=bool)
+    for x, y, w, h in windows:
+        assert (w, h) == (128, 128)
+        assert 0 <= x <= 300 - 128 and 0 <= y <= 200 - 128
+        covered[y:y + h, x:x + w] = True
+    assert covered.all()
+    with pytest.raises(ValueError):
+        gdalTools.sliding_windows(300, 200, tile_size=64, overlap=64)
+
+
+@pytest.mark.parametrize('blend', ['average', 'cosine', 'max'])
+def test_stitched_mosaic_matches_source(tmp_path, blend):
+    data = np.random.RandomState(0).randint(0, 256, (2, 200, 300)).astype(np.uint8)
+    source = _make_raster(tmp_path / 'source.tif', data)
+    output = str(tmp_path / 'mosaic.tif')
+    tiles = list(gdalTools.iter_tiles(source, tile_size=128, overlap=32))
+    random.Random(0).shuffle(tiles)  # 窗口可以按任意顺序加入
+    stitcher = gdalTools.MosaicStitcher(output, source, bands=2, datatype=np.uint8, tile_size=128, overlap=32,
+                                        blend=blend)
+    for window, _, tile in tiles:
+        stitcher.add(window, tile)
+    # 所有窗口加入后每个格网单元都已写出
+    assert stitcher._cells == {}
+    stitcher.close()
+
+    ds = gdal.Open(output)
+    assert ds.GetRasterBand(1).GetNoDataValue() is None
+    np.testing.assert_array_equal(ds.ReadAsArray(), data)
+
+
+def test_mosaic_fills_missing_windows(tmp_path):
+    data = np.ones((100, 100), dtype=np.float32)
+    source = _make_raster(tmp_path / 'source.tif', data)
+    output = str(tmp_path / 'mosaic.tif')
+    with gdalTools.MosaicStitcher(output, source, tile_size=64, overlap=16, nodata=-1.) as stitcher:
+        window, _, tile = next(gdalTools.iter_tiles(source, tile_size=64, overlap=16))
+        stitcher.add(window, tile[0])
+    result = gdal.Open(output).ReadAsArray()
+    assert (result[:48, :48] == 1.).all()
+    assert (result[64:, 64:] == -1.).all()
+
+
+@pytest.mark.parametrize('dtype', [np.uint8, np.int16, np.uint16])
+def test_histogram_percentiles_match_numpy(tmp_path, dtype):
+    # 69 x 29 = 2001 个像素，整数百分位的秩为整数，与 np.percentile 的线性插值一致
+    info = np.iinfo(dtype)
+    data = np.random.RandomState(1).randint(max(info.min, -1000), min(info.max, 1000), (29, 69)).astype(dtype)
+    ds = gdal.Open(_make_raster(tmp_path / 'band.tif', data))
+    percents = (0, 2, 25, 50, 98, 100)
+    values = _histogram_percentiles(*_band_histogram(ds, [1], None, 65536), percents=percents)
+    assert values == [float(np.percentile(data, p)) for p in percents]
+
+
+def test_histogram_of_constant_and_empty_bands(tmp_path):
+    constant = np.full((20, 30), 2.5, dtype=np.float32)
+    ds = gdal.Open(_make_raster(tmp_path / 'constant.tif', constant))
+    assert _histogram_percentiles(*_band_histogram(ds, [1], None, 256), percents=(2, 98)) == [2.5, 2.5]
+    ds = gdal.Open(_make_raster(tmp_path / 'empty.tif', np.zeros((20, 30), dtype=np.float32), nodata=0.))
+    assert _histogram_percentiles(*_band_histogram(ds, [1], 0., 256), percents=(2, 98)) == [None, None]
+
+    output = str(tmp_path / 'stretched.tif')
+    limits = gdalTools.stretch_raster(str(tmp_path / 'constant.tif'), output, lower_percent=2, higher_percent=98)
+    assert limits == [(2.5, 2.5)]
+    assert (gdal.Open(output).ReadAsArray() == 0).all()
+
+
+def test_creation_options():
+    assert gdalTools.creation_options('gtiff') == []
+    options = gdalTools.creation_options('deflate', gdal.GDT_UInt16, block_size=512)
+    assert 'COMPRESS=DEFLATE' in options and 'PREDICTOR=2' in options and 'BLOCKXSIZE=512' in options
+    assert 'PREDICTOR=3' in gdalTools.creation_options('zstd', np.float32)
+    assert not any(option.startswith('COMPRESS') for option in gdalTools.creation_options('tiled'))
+    with pytest.raises(ValueError):
+        gdalTools.creation_options('jpeg2000')
+
+
+@pytest.mark.parametrize('profile', ['deflate', 'cog'])
+def test_tiled_writer_round_trip(tmp_path, profile):
+    data = np.random.RandomState(2).randint(0, 1000, (2, 150, 170)).astype(np.uint16)
+    output = str(tmp_path / ('%s.tif' % profile))
+    with gdalTools.TiledWriter(output, 170, 150, 2, np.uint16, None, (0., 1., 0., 150., 0., -1.),
+                               block_size=64, profile=profile) as writer:
+        # 瓦片以任意顺序写入
+        for y in (128, 64, 0):
+            for x in (128, 0, 64):
+                writer.write(x, y, data[:, y:y + 64, x:x + 64])
+    ds = gdal.Open(output)
+    np.testing.assert_array_equal(ds.ReadAsArray(), data)
+    assert ds.GetRasterBand(1).GetBlockSize() == [64, 64]
+    if profile == 'cog':
+        assert ds.GetMetadata('IMAGE_STRUCTURE').get('LAYOUT') == 'COG'
+        assert ds.GetRasterBand(1).GetOverviewCount() > 0
@@ -0,0 +1,190 @@
+"""
+    the pipeline wrappers compared with plain per-feature OGR on small synthetic layers
+"""
+import pytest
+
+ogr = pytest.importorskip('osgeo.ogr')
+osr = pytest.importorskip('osgeo.osr')
+pytest.importorskip('shapely')
+
+import gdalTools
+
+
+def _square(x, y, size):
+    ring = ogr.Geometry(ogr.wkbLinearRing)
+    for px, py in ((x, y), (x + size, y), (x + size, y + size), (x, y + size), (x, y)):
+        ring.AddPoint_2D(px, py)
+    polygon = ogr.Geometry(ogr.wkbPolygon)
+    polygon.AddGeometry(ring)
+    return polygon
+
+
+def _make_layer(path, geometries, driver='ESRI Shapefile', geom_type=None):
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(3857)
+    if geom_type is None:
+        geom_type = ogr.wkbMultiPolygon if driver == 'ESRI Shapefile' else ogr.wkbUnknown
+    ds = ogr.GetDriverByName(driver).CreateDataSource(str(path))
+    lyr = ds.CreateLayer('squares', srs, geom_type)
+    lyr.CreateField(ogr.FieldDefn('id', ogr.OFTInteger))
+    lyr.CreateField(ogr.FieldDefn('cls', ogr.OFTInteger))
+    for i, geometry in enumerate(geometries):
+        feature = ogr.Feature(lyr.GetLayerDefn())
+        feature.SetField('id', i)
+        feature.SetField('cls', i % 3)
+        feature.SetGeometry(geometry)
+        lyr.CreateFeature(feature)
+    ds = None
+    return str(path)
+
+
+def _squares(n, size=4., step=10.):
+    return [_square((i % 20) * step, (i // 20) * step, size * (1 + i % 4) / 2.) for i in range(n)]
+
+
+def _read(path):
+    ds = ogr.Open(str(path))
+    lyr = ds.GetLayer()
+    rows = [(feature.GetField('id') if feature.GetFieldIndex('id') >= 0 else None,
+             feature.GetGeometryRef().Clone() if feature.GetGeometryRef() is not None else None)
+            for feature in lyr]
+    return rows
+
+
+@pytest.fixture
+def squares(tmp_path):
+    geometries = _squares(40)
+    multi = ogr.Geometry(ogr.wkbMultiPolygon)
+    multi.AddGeometry(_square(500., 500., 3.))
+    multi.AddGeometry(_square(510., 500., 5.))
+    geometries.append(multi)
+    return _make_layer(tmp_path / 'squares.shp', geometries)
+
+
+def test_buffer_matches_ogr(squares, tmp_path):
+    out = tmp_path / 'buffer.shp'
+    gdalTools.buffer(squares, str(out), bdistance=1.5)
+    expected = {id_: geometry.Buffer(1.5, 30).GetArea() for id_, geometry in _read(squares)}
+    result = _read(out)
+    assert len(result) == len(expected)
+    for id_, geometry in result:
+        assert geometry.GetArea() == pytest.approx(expected[id_], rel=1e-6)
+
+
+def test_explode_matches_ogr(squares, tmp_path):
+    out = tmp_path / 'parts.shp'
+    count = gdalTools.multipoly2singlepoly(squares, str(out))
+    expected = sum(geometry.GetGeometryCount() if geometry.GetGeometryType() == ogr.wkbMultiPolygon else 1
+                   for _, geometry in _read(squares))
+    result = _read(out)
+    assert count == len(result) == expected
+    assert all(ogr.GT_Flatten(geometry.GetGeometryType()) == ogr.wkbPolygon for _, geometry in result)
+
+
+def test_dissolve_matches_ogr(squares, tmp_path):
+    out = tmp_path / 'dissolved.shp'
+    gdalTools.dissolve(squares, str(out))
+    union = ogr.Geometry(ogr.wkbMultiPolygon)
+    for _, geometry in _read(squares):
+        union = union.Union(geometry)
+    result = _read(out)
+    assert len(result) == 1
+    assert result[0][1].GetArea() == pytest.approx(union.GetArea(), rel=1e-9)
+
+
+@pytest.mark.parametrize('method', ['sql', 'array'])
+def test_filter_by_area_on_gpkg(tmp_path, method):
+    source = _make_layer(tmp_path / 'squares.gpkg', _squares(40), driver='GPKG')
+    out = tmp_path / ('filtered_%s.gpkg' % method)
+    count = gdalTools.filter_by_area(source, str(out), min_area=10., method=method)
+    expected = sorted(id_ for id_, geometry in _read(source) if geometry.GetArea() >= 10.)
+    assert count == len(expected)
+    assert sorted(id_ for id_, _ in _read(out)) == expected
+
+
+def test_workers_keep_every_gpkg_feature(tmp_path):
+    # GPKG 的 FID 从 1 开始，分块必须按真实 FID 划分
+    source = _make_layer(tmp_path / 'many.gpkg', _squares(2500, size=1.), driver='GPKG')
+    out = tmp_path / 'buffer.gpkg'
+    gdalTools.buffer(source, str(out), bdistance=0.5, workers=2)
+    assert sorted(id_ for id_, _ in _read(out)) == list(range(2500))
+
+
+def test_line2pol_skips_degenerate_lines(tmp_path):
+    lines = []
+    for points in (((0, 0), (4, 0), (4, 4)), ((0, 0), (4, 0), (0, 0)), ((0, 0), (4, 4)),
+                   ((10, 0), (14, 0), (14, 0), (14, 4), (10, 0))):
+        line = ogr.Geometry(ogr.wkbLineString)
+        for x, y in points:
+            line.AddPoint_2D(x, y)
+        lines.append(line)
+    source = _make_layer(tmp_path / 'lines.gpkg', lines, driver='GPKG')
+    out = tmp_path / 'polygons.shp'
+    gdalTools.line2pol(source, str(out))
+    result = _read(out)
+    assert sorted(id_ for id_, _ in result) == [0, 3]
+    assert all(geometry.GetArea() == pytest.approx(8.) for _, geometry in result)
+
+
+def test_dissolve_empty_layer(tmp_path):
+    source = _make_layer(tmp_path / 'empty.shp', [])
+    out = tmp_path / 'dissolved.shp'
+    gdalTools.dissolve(source, str(out))
+    assert _read(out) == []
+
+
+@pytest.mark.parametrize('where', [None, 'cls = 1'])
+def test_workers_read_shapefile_slices(tmp_path, where):
+    source = _make_layer(tmp_path / 'many.shp', _squares(2500, size=1.))
+    out = tmp_path / 'buffer.shp'
+    gdalTools.VectorPipeline(source, workers=2, where=where).buffer(0.5).write(str(out))
+    expected = [i for i in range(2500) if where is None or i % 3 == 1]
+    assert sorted(id_ for id_, _ in _read(out)) == expected
+
+
+def test_array_filter_keeps_where_fields(squares, tmp_path):
+    out = tmp_path / 'filtered.shp'
+    count = gdalTools.filter_by_area(squares, str(out), min_area=10., where='cls = 1', method='array')
+    ds = ogr.Open(squares)
+    expected = sorted(feature.GetField('id') for feature in ds.GetLayer()
+                      if feature.GetField('cls') == 1 and feature.GetGeometryRef().GetArea() >= 10.)
+    assert count == len(expected) > 0
+    assert sorted(id_ for id_, _ in _read(out)) == expected
+    statistics = gdalTools.geometry_statistics(squares, ('area',), where='cls = 1', cache=False)
+    assert statistics['area']['count'] == sum(1 for i in range(41) if i % 3 == 1)
+
+
+def test_intersection_of_lines_and_polygons(squares, tmp_path):
+    line = ogr.Geometry(ogr.wkbLineString)
+    line.AddPoint_2D(-5., 1.)
+    line.AddPoint_2D(300., 1.)
+    lines = _make_layer(tmp_path / 'lines.gpkg', [line], driver='GPKG', geom_type=ogr.wkbLineString)
+    out = tmp_path / 'intersection.shp'
+    gdalTools.intersection(lines, squares, str(out), keep_fields=False)
+    ds = ogr.Open(str(out))
+    layer = ds.GetLayer()
+    assert ogr.GT_Flatten(layer.GetGeomType()) == ogr.wkbMultiLineString
+    expected = sum(geometry.Intersection(line).Length() for _, geometry in _read(squares))
+    assert sum(feature.GetGeometryRef().Length() for feature in layer) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('workers', [None, 2])
+def test_attributes_follow_exploded_parts(squares, tmp_path, workers):
+    out = tmp_path / 'parts.gpkg'
+    gdalTools.multipoly2singlepoly(squares, str(out), workers=workers)
+    ds = ogr.Open(str(out))
+    rows = sorted((feature.GetField('parent_fid'), feature.GetField('id'), feature.GetField('cls'))
+                  for feature in ds.GetLayer())
+    assert rows[-2:] == [(40, 40, 1), (40, 40, 1)]
+    assert all(fid == id_ and cls == id_ % 3 for fid, id_, cls in rows)
+
+
+def test_isolated_multipart_keeps_every_part(tmp_path):
+    multi = ogr.Geometry(ogr.wkbMultiPolygon)
+    multi.AddGeometry(_square(0., 0., 1.))
+    multi.AddGeometry(_square(50., 0., 1.))
+    source = _make_layer(tmp_path / 'isolated.shp', [multi, _square(100., 0., 1.)])
+    out = tmp_path / 'extracted.shp'
+    gdalTools.extract_isolated_features(source, str(out), bdistance=1.)
+    areas = {id_: geometry.GetArea() for id_, geometry in _read(out)}
+    assert areas == {0: pytest.approx(2.), 1: pytest.approx(1.)}